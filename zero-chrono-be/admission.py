@@ -0,0 +1,280 @@
+import bisect
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import metrics
+
+# Lower value = served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+LIMIT = metrics.gauge("zc_llm_concurrency_limit", "Current adaptive LLM concurrency limit.")
+INFLIGHT = metrics.gauge("zc_llm_inflight", "LLM requests currently admitted.")
+QUEUE_DEPTH = metrics.gauge("zc_llm_queue_depth", "Requests waiting for an LLM slot.")
+REJECTIONS = metrics.counter(
+    "zc_admission_rejections_total", "Requests rejected before reaching the LLM.", ("reason", "priority")
+)
+WAIT_SECONDS = metrics.histogram(
+    "zc_admission_wait_seconds", "Time spent queued for an LLM slot.", ("priority",)
+)
+
+
+class Rejected(RuntimeError):
+    """Raised when a request is not admitted. `status` is the HTTP code to return."""
+
+    status = 503
+    reason = "overloaded"
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(Rejected):
+    status = 429
+    reason = "queue_full"
+
+
+class DeadlineExceeded(Rejected):
+    status = 503
+    reason = "deadline"
+
+
+class _Waiter:
+    __slots__ = ("key", "priority", "deadline", "granted", "shed")
+
+    def __init__(self, priority: int, seq: int, deadline: float) -> None:
+        self.key = (priority, seq)
+        self.priority = priority
+        self.deadline = deadline
+        self.granted = False
+        self.shed = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+
+class AdmissionController:
+    """Bounded, priority-ordered admission in front of the LLM backend.
+
+    The concurrency limit follows AIMD: it grows by 1/limit after each
+    completion within the latency target and is multiplied by `backoff` (at
+    most once per observed latency) on errors or slow completions. Unless a
+    fixed target is given, the target is `tolerance` times the best latency
+    seen recently for the same priority class, so the limit settles where
+    queueing inside the inference server starts to add latency and long
+    background prompts are not judged against short interactive ones.
+    Latency EWMAs (for wait estimates and the decrease window) are kept per
+    class for the same reason.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        max_queue: int = 16,
+        target_latency: Optional[float] = None,
+        tolerance: float = 2.0,
+        backoff: float = 0.7,
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_queue = max(0, max_queue)
+        self.target_latency = target_latency
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._inflight = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._ewma_latency: Dict[int, float] = {}
+        self._best_latency: Dict[int, float] = {}
+        self._last_decrease = 0.0
+        self._publish()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        target = os.getenv("LLM_TARGET_LATENCY_S")
+        return cls(
+            initial_limit=int(os.getenv("LLM_INITIAL_CONCURRENCY", "2")),
+            min_limit=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+            max_limit=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "16")),
+            target_latency=float(target) if target else None,
+        )
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _publish(self) -> None:
+        LIMIT.set(self.limit)
+        INFLIGHT.set(self._inflight)
+        QUEUE_DEPTH.set(len(self._waiters))
+
+    def _reject(self, exc: Rejected, priority: int) -> Rejected:
+        REJECTIONS.inc(reason=exc.reason, priority=_PRIORITY_NAMES.get(priority, str(priority)))
+        return exc
+
+    def _latency_for(self, priority: int) -> Optional[float]:
+        """EWMA latency of a class, or the fastest known class as a stand-in."""
+        latency = self._ewma_latency.get(priority)
+        if latency is None and self._ewma_latency:
+            latency = min(self._ewma_latency.values())
+        return latency
+
+    def _estimate_wait(self, ahead: List[_Waiter], priority: int) -> Optional[float]:
+        """Predicted time to completion for a new waiter.
+
+        Work queued ahead (each waiter at its own class's latency) is spread
+        over the limit, then this request's own expected latency is added.
+        """
+        own = self._latency_for(priority)
+        if own is None:
+            return None
+        queued = sum(self._latency_for(w.priority) or own for w in ahead)
+        return queued / self.limit + own
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, deadline: float = math.inf) -> None:
+        """Block until a slot is granted; `deadline` is a time.monotonic() value."""
+        start = time.monotonic()
+        name = _PRIORITY_NAMES.get(priority, str(priority))
+        with self._cond:
+            if deadline <= start:
+                raise self._reject(DeadlineExceeded("Deadline already passed"), priority)
+            if self._inflight < self.limit and not self._waiters:
+                self._inflight += 1
+                self._publish()
+                WAIT_SECONDS.observe(0.0, priority=name)
+                return
+
+            ahead = [w for w in self._waiters if w.priority <= priority]
+            estimate = self._estimate_wait(ahead, priority)
+            if estimate is not None and start + estimate > deadline:
+                raise self._reject(
+                    Rejected("LLM backend overloaded; predicted wait exceeds deadline", retry_after=estimate),
+                    priority,
+                )
+            if len(self._waiters) >= self.max_queue:
+                worst = self._waiters[-1] if self._waiters else None
+                if worst is None or worst.priority <= priority:
+                    raise self._reject(QueueFull("LLM request queue is full", retry_after=estimate), priority)
+                # Shed the newest lower-priority waiter to make room.
+                self._waiters.pop()
+                worst.shed = True
+
+            waiter = _Waiter(priority, next(self._seq), deadline)
+            bisect.insort(self._waiters, waiter)
+            self._publish()
+            self._cond.notify_all()
+            try:
+                while not waiter.granted:
+                    if waiter.shed:
+                        raise self._reject(QueueFull("Shed in favour of a higher-priority request"), priority)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject(DeadlineExceeded("Timed out waiting for an LLM slot"), priority)
+                    self._cond.wait(remaining if remaining != math.inf else None)
+            finally:
+                if not waiter.granted and waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self._publish()
+        WAIT_SECONDS.observe(time.monotonic() - start, priority=name)
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        ok: bool = True,
+        priority: int = PRIORITY_INTERACTIVE,
+        count: bool = True,
+    ) -> None:
+        """Free a slot; `count=False` leaves the limit and latency stats alone."""
+        with self._cond:
+            self._inflight = max(0, self._inflight - 1)
+            if count:
+                self._adjust(latency, ok, priority)
+            self._dispatch()
+            self._publish()
+
+    def _adjust(self, latency: Optional[float], ok: bool, priority: int) -> None:
+        now = time.monotonic()
+        best = self._best_latency.get(priority)
+        if ok and latency is not None:
+            ewma = self._ewma_latency.get(priority)
+            self._ewma_latency[priority] = latency if ewma is None else 0.8 * ewma + 0.2 * latency
+            # Let the best-seen latency drift up slowly so the target can
+            # follow a model or hardware change.
+            best = latency if best is None else min(latency, best * 1.05)
+            self._best_latency[priority] = best
+        target = self.target_latency
+        if target is None and best is not None:
+            target = best * self.tolerance
+        slow = latency is not None and target is not None and latency > target
+        if not ok or slow:
+            window = self._ewma_latency.get(priority) or 0.0
+            if now - self._last_decrease >= window:
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.pop(0)
+            if waiter.deadline <= now:
+                continue  # its own wait loop raises DeadlineExceeded
+            waiter.granted = True
+            self._inflight += 1
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(
+        self,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None,
+        is_congestion: Optional[Callable[[BaseException], bool]] = None,
+    ) -> Iterator[float]:
+        """Hold an LLM slot for the duration of the block.
+
+        Yields the absolute deadline (time.monotonic()) so callers can bound
+        the downstream call with the time that is left. A timeout of zero
+        or less is already expired; None means no deadline.
+
+        An exception out of the block cuts the limit only if `is_congestion`
+        says so (every exception does when it is None); other errors, such
+        as a bad request, just free the slot.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else math.inf
+        self.acquire(priority, deadline)
+        start = time.monotonic()
+        try:
+            yield deadline
+        except BaseException as exc:
+            congested = is_congestion is None or is_congestion(exc)
+            self.release(time.monotonic() - start, False, priority, count=congested)
+            raise
+        self.release(time.monotonic() - start, True, priority)
+
+
+def remaining(deadline: float) -> Optional[float]:
+    """Seconds left until a monotonic deadline, or None when unbounded."""
+    if deadline == math.inf:
+        return None
+    return max(0.001, deadline - time.monotonic())
@@ -0,0 +1,234 @@
+"""Minimal OpenAI-compatible stand-in for LM Studio, for benchmarks.
+
+Serves GET /v1/models and POST /v1/chat/completions with canned content and
+simulated timing: a fixed latency, prefill of uncached prompt tokens, and
+completion tokens at a fixed decode rate. Like llama.cpp/LM Studio, the
+prompt cache reuses the longest prefix shared with a recent prompt. Run
+standalone with ``python bench/mock_lmstudio.py --port 1234``.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_NODES = json.dumps(
+    [
+        {"title": "Hepatic encephalopathy", "body": "Synthetic node body.", "tags": "Diagnosis"},
+        {"title": "Sodium", "body": "Synthetic node body.", "tags": "Lab"},
+        {"title": "Tiotropium Bromide", "body": "Synthetic node body.", "tags": "Medication"},
+    ]
+)
+DEFAULT_LINKS = json.dumps(
+    {
+        "Links": [
+            {
+                "source": "Hepatic encephalopathy",
+                "source_type": "Diagnosis",
+                "target": "Sodium",
+                "target_type": "Lab",
+                "description": "Synthetic link.",
+            },
+            {
+                "source": "Sodium",
+                "source_type": "Lab",
+                "target": "Tiotropium Bromide",
+                "target_type": "Medication",
+                "description": "Synthetic link.",
+            },
+        ]
+    }
+)
+# First matching substring wins; the empty match is the fallback.
+DEFAULT_CANNED: List[Dict[str, str]] = [
+    {"match": '{"Links"', "content": DEFAULT_LINKS},
+    {"match": "", "content": DEFAULT_NODES},
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly four characters per token, like most BPE vocabularies."""
+    return max(1, len(text or "") // 4)
+
+
+class MockConfig:
+    def __init__(
+        self,
+        model: str = "mock-model",
+        latency: float = 0.05,
+        tokens_per_sec: float = 0.0,
+        canned: Optional[List[Dict[str, str]]] = None,
+        prefill_tokens_per_sec: float = 0.0,
+        prefix_cache_size: int = 8,
+    ) -> None:
+        self.model = model
+        # Seconds added to every completion (queueing + time to first token).
+        self.latency = latency
+        # Decode rate for completion tokens; 0 disables decode delay.
+        self.tokens_per_sec = tokens_per_sec
+        self.canned = canned or DEFAULT_CANNED
+        # Prefill rate for prompt tokens not covered by the prefix cache.
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec
+        self.prefix_cache_size = prefix_cache_size
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefill_seconds = 0.0
+        self._recent_prompts: List[str] = []
+        self._lock = threading.Lock()
+
+    def prefill(self, prompt: str) -> Tuple[int, int, float]:
+        """Return (prompt tokens, cached tokens, simulated prefill seconds)."""
+        with self._lock:
+            shared = max((len(os.path.commonprefix([prompt, p])) for p in self._recent_prompts), default=0)
+            self._recent_prompts.append(prompt)
+            if len(self._recent_prompts) > self.prefix_cache_size:
+                self._recent_prompts.pop(0)
+            total = estimate_tokens(prompt)
+            cached = min(total, shared // 4)
+            seconds = (total - cached) / self.prefill_tokens_per_sec if self.prefill_tokens_per_sec > 0 else 0.0
+            self.prompt_tokens += total
+            self.cached_tokens += cached
+            self.prefill_seconds += seconds
+        return total, cached, seconds
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.prompt_tokens = self.cached_tokens = 0
+            self.prefill_seconds = 0.0
+            self._recent_prompts = []
+
+    def pick_content(self, prompt: str) -> str:
+        for entry in self.canned:
+            if entry.get("match", "") in prompt:
+                return entry["content"]
+        return self.canned[-1]["content"]
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MockLMStudio/0.1"
+    config: MockConfig
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+    def _send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": self.config.model, "object": "model"}]})
+            return
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json({"error": "invalid JSON"}, 400)
+            return
+
+        cfg = self.config
+        cfg.count_request()
+        messages = body.get("messages") or []
+        # Serialize roughly like a chat template so role order matters.
+        prompt = "".join(f"<|{m.get('role')}|>\n{m.get('content') or ''}\n" for m in messages)
+        content = cfg.pick_content(prompt)
+        prompt_tokens, cached_tokens, prefill_seconds = cfg.prefill(prompt)
+        completion_tokens = estimate_tokens(content)
+
+        delay = cfg.latency + prefill_seconds
+        if cfg.tokens_per_sec > 0:
+            delay += completion_tokens / cfg.tokens_per_sec
+        if delay > 0:
+            time.sleep(delay)
+
+        self._send_json(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model") or cfg.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                },
+            }
+        )
+
+
+def serve(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the mock server on a daemon thread; returns the running server."""
+    handler = type("MockHandler", (_Handler,), {"config": config})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, name="mock-lmstudio", daemon=True)
+    thread.start()
+    return httpd
+
+
+def base_url(httpd: ThreadingHTTPServer) -> str:
+    host, port = httpd.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible LM Studio server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--model", default="mock-model")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed seconds per completion.")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Decode rate (0 = instant).")
+    parser.add_argument(
+        "--prefill-tokens-per-sec", type=float, default=0.0, help="Prefill rate for uncached tokens (0 = instant)."
+    )
+    parser.add_argument(
+        "--canned",
+        default=None,
+        help='JSON file with a list of {"match": "...", "content": "..."} responses.',
+    )
+    args = parser.parse_args()
+
+    canned = None
+    if args.canned:
+        with open(args.canned, "r", encoding="utf-8") as f:
+            canned = json.load(f)
+    config = MockConfig(
+        args.model, args.latency, args.tokens_per_sec, canned, prefill_tokens_per_sec=args.prefill_tokens_per_sec
+    )
+    httpd = serve(config, args.host, args.port)
+    print(f"Mock LM Studio listening on {base_url(httpd)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
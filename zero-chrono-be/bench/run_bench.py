@@ -0,0 +1,464 @@
+"""Reproducible backend benchmarks against the mock LM Studio server.
+
+Examples:
+    python bench/run_bench.py --sizes 1000,10000 --out bench_results/run.json
+    python bench/run_bench.py --compare bench_results/before.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DATA_DIR = os.path.join(BACKEND_DIR, "data")
+for path in (BACKEND_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+import mock_lmstudio  # type: ignore
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of values (pct in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(name: str, latencies: List[float], wall: float, items: int, **extra: Any) -> Dict[str, Any]:
+    result = {
+        "scenario": name,
+        "runs": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_per_s": round(items / wall, 3) if wall > 0 else 0.0,
+    }
+    result.update(extra)
+    return result
+
+
+def measure_peak_mb(fn: Callable[[], Any]) -> float:
+    """Run fn once under tracemalloc; kept separate so timings are not skewed."""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1 << 20), 3)
+
+
+def write_synthetic_csv(template_path: str, out_path: str, rows: int) -> None:
+    """Scale a real extract to `rows` data rows, varying the leading id column."""
+    with open(template_path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    header, body = lines[0], [l for l in lines[1:] if l]
+    with open(out_path, "w", encoding="utf-8", newline="") as f:
+        f.write(header + "\n")
+        for i in range(rows):
+            line = body[i % len(body)]
+            _, _, rest = line.partition(",")
+            f.write(f"{i},{rest}\n")
+
+
+def bench_csv_context(sizes: Sequence[int], repeat: int, work_dir: str) -> List[Dict[str, Any]]:
+    import csv_cache
+    import lm_test
+
+    results: List[Dict[str, Any]] = []
+    template = os.path.join(DATA_DIR, "labs.csv")
+    for size in sizes:
+        path = os.path.join(work_dir, f"labs_{size}.csv")
+        write_synthetic_csv(template, path, size)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+        def from_file() -> str:
+            return lm_test._build_csv_context_from_file(path, ",", size, "*", 4000)
+
+        def from_text() -> str:
+            return lm_test._build_csv_context_from_text(text, ",", size, "*", 4000)
+
+        def cold_cache() -> str:
+            csv_cache.clear_tables()
+            cache_file = csv_cache.cache_path_for(path, ",")
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            return from_file()
+
+        scenarios = [
+            ("csv_context.parse_file", "0", from_file),
+            ("csv_context.parse_text", "0", from_text),
+            ("csv_context.cache_cold", "1", cold_cache),
+            ("csv_context.cache_warm", "1", from_file),
+        ]
+        for name, cache_flag, fn in scenarios:
+            os.environ["CSV_CACHE"] = cache_flag
+            fn()  # warm imports and, for the warm scenario, the cache itself
+            latencies: List[float] = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - t0)
+            wall = time.perf_counter() - start
+            peak = measure_peak_mb(fn)
+            results.append(summarize(name, latencies, wall, size * repeat, rows=size, peak_mem_mb=peak))
+            print(f"  {name} rows={size} p50={results[-1]['p50_ms']}ms peak={peak}MB")
+    os.environ.pop("CSV_CACHE", None)
+    return results
+
+
+def bench_generate(requests: int, concurrency: int) -> List[Dict[str, Any]]:
+    import server
+
+    app = server.create_main_app()
+    csv_text = open(os.path.join(DATA_DIR, "medications.csv"), "r", encoding="utf-8").read()
+    payloads = {
+        "generate.prompt_only": {"prompt": "Summarize the patient's medications."},
+        "generate.with_csv": {"prompt": "Summarize the patient's medications.", "csv_content": csv_text},
+    }
+    local = threading.local()
+
+    results: List[Dict[str, Any]] = []
+    for name, payload in payloads.items():
+
+        def one(_: int, payload: Dict[str, Any] = payload) -> float:
+            client = getattr(local, "client", None)
+            if client is None:
+                client = local.client = app.test_client()
+            t0 = time.perf_counter()
+            resp = client.post("/generate", json=payload)
+            if resp.status_code != 200:
+                raise RuntimeError(f"/generate returned {resp.status_code}: {resp.get_data(as_text=True)}")
+            return time.perf_counter() - t0
+
+        one(0)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - start
+        peak = measure_peak_mb(lambda: one(0))
+        results.append(summarize(name, latencies, wall, requests, concurrency=concurrency, peak_mem_mb=peak))
+        print(f"  {name} c={concurrency} p50={results[-1]['p50_ms']}ms rps={results[-1]['throughput_per_s']}")
+    return results
+
+
+def bench_graph(repeat: int, work_dir: str) -> List[Dict[str, Any]]:
+    import server
+
+    graph_root = os.path.join(work_dir, "graph_root")
+    os.makedirs(graph_root, exist_ok=True)
+    for name in ("diagnoses.csv", "labs.csv", "medications.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), os.path.join(graph_root, name))
+    os.environ["GRAPH_ROOT"] = graph_root
+    graph_json = os.path.join(graph_root, "graph.json")
+    client = server.create_main_app().test_client()
+
+    def fetch() -> None:
+        resp = client.get("/graph")
+        body = resp.get_json() or {}
+        if resp.status_code != 200 or body.get("error"):
+            raise RuntimeError(f"/graph failed: {body.get('error') or resp.status_code}")
+
+    def cold() -> None:
+        if os.path.exists(graph_json):
+            os.remove(graph_json)
+        fetch()
+
+    results: List[Dict[str, Any]] = []
+    for name, fn in (("graph.cold", cold), ("graph.warm", fetch)):
+        fn()
+        latencies: List[float] = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start
+        peak = measure_peak_mb(fn)
+        results.append(summarize(name, latencies, wall, repeat, peak_mem_mb=peak))
+        print(f"  {name} p50={results[-1]['p50_ms']}ms")
+    os.environ.pop("GRAPH_ROOT", None)
+    return results
+
+
+def _rotated_rows(path: str, offset: int, limit: Optional[int] = None) -> str:
+    """CSV text with data rows rotated by `offset`, so each call differs from the start."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    header, body = lines[0], [l for l in lines[1:] if l]
+    offset %= len(body)
+    body = body[offset:] + body[:offset]
+    if limit is not None:
+        body = body[:limit]
+    return "\n".join([header] + body) + "\n"
+
+
+def bench_prefill(
+    config: "mock_lmstudio.MockConfig", repeat: int, requests: int, work_dir: str
+) -> List[Dict[str, Any]]:
+    """Compare prompt layouts by the prefill work the mock's prefix cache saves.
+
+    Requests run sequentially so cache reuse is deterministic. Every graph
+    rebuild and prefill.generate call sees different patient data. In
+    prefill.generate_pinned each patient's table is pinned once with
+    context_id and followed by several different questions about it.
+
+    For /generate both layouts send instructions, table, question in the
+    same byte order, so only the pinned scenario shows a cache gain, and it
+    shows it for both layouts.
+    """
+    import prompt_layout
+    import server
+
+    graph_root = os.path.join(work_dir, "prefill_root")
+    os.makedirs(graph_root, exist_ok=True)
+    graph_json = os.path.join(graph_root, "graph.json")
+    os.environ["GRAPH_ROOT"] = graph_root
+    question = "Which results need follow-up, and why?"
+    follow_ups = (
+        question,
+        "Summarize the abnormal values.",
+        "Which of these changed since the previous draw?",
+        "List any values that need a repeat test.",
+    )
+
+    results: List[Dict[str, Any]] = []
+    for layout in prompt_layout.LAYOUTS:
+        os.environ["PROMPT_LAYOUT"] = layout
+        client = server.create_main_app().test_client()
+
+        def graph_build(i: int) -> None:
+            for name in ("diagnoses.csv", "labs.csv", "medications.csv"):
+                with open(os.path.join(graph_root, name), "w", encoding="utf-8") as f:
+                    f.write(_rotated_rows(os.path.join(DATA_DIR, name), i * 7))
+            if os.path.exists(graph_json):
+                os.remove(graph_json)
+            resp = client.get("/graph")
+            if (resp.get_json() or {}).get("error"):
+                raise RuntimeError(f"/graph failed: {resp.get_json()['error']}")
+
+        def generate(i: int) -> None:
+            csv_text = _rotated_rows(os.path.join(DATA_DIR, "labs.csv"), i * 13, limit=40)
+            resp = client.post("/generate", json={"prompt": question, "csv_content": csv_text})
+            if resp.status_code != 200:
+                raise RuntimeError(f"/generate returned {resp.status_code}")
+
+        def generate_pinned(i: int) -> None:
+            patient, turn = divmod(i, len(follow_ups))
+            payload: Dict[str, Any] = {"prompt": follow_ups[turn], "context_id": f"{layout}-{patient}"}
+            if turn == 0:
+                payload["csv_content"] = _rotated_rows(os.path.join(DATA_DIR, "labs.csv"), patient * 13, limit=40)
+            resp = client.post("/generate", json=payload)
+            if resp.status_code != 200:
+                raise RuntimeError(f"/generate returned {resp.status_code}")
+
+        scenarios = (
+            ("prefill.graph_build", graph_build, repeat),
+            ("prefill.generate", generate, requests),
+            ("prefill.generate_pinned", generate_pinned, requests),
+        )
+        for name, fn, count in scenarios:
+            config.reset_stats()
+            latencies: List[float] = []
+            start = time.perf_counter()
+            for i in range(count):
+                t0 = time.perf_counter()
+                fn(i)
+                latencies.append(time.perf_counter() - t0)
+            wall = time.perf_counter() - start
+            cached_ratio = config.cached_tokens / config.prompt_tokens if config.prompt_tokens else 0.0
+            results.append(
+                summarize(
+                    name,
+                    latencies,
+                    wall,
+                    count,
+                    layout=layout,
+                    prompt_tokens=config.prompt_tokens,
+                    cached_tokens=config.cached_tokens,
+                    cached_ratio=round(cached_ratio, 4),
+                    prefill_seconds=round(config.prefill_seconds, 4),
+                )
+            )
+            print(
+                f"  {name} layout={layout} p50={results[-1]['p50_ms']}ms "
+                f"cached={cached_ratio:.1%} prefill={config.prefill_seconds:.3f}s"
+            )
+    os.environ.pop("PROMPT_LAYOUT", None)
+    os.environ.pop("GRAPH_ROOT", None)
+    return results
+
+
+# Runs in a fresh interpreter so import and first-request costs are cold.
+_STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import server
+t1 = time.perf_counter()
+app = server.create_main_app()
+t2 = time.perf_counter()
+client = app.test_client()
+while client.get("/ready").get_json()["status"] == "warming":
+    time.sleep(0.01)
+t3 = time.perf_counter()
+resp = client.post("/generate", json={"prompt": "ping"})
+t4 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "ready": t3 - t2,
+                  "first_generate": t4 - t3, "status": resp.status_code}))
+"""
+
+
+def bench_startup(repeat: int) -> List[Dict[str, Any]]:
+    """Cold import, readiness and first /generate latency, with and without warm-up."""
+    results: List[Dict[str, Any]] = []
+    for warmup in ("0", "1"):
+        env = dict(os.environ, WARMUP=warmup, LOG_LEVEL="WARNING")
+        runs: List[Dict[str, float]] = []
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, "-c", _STARTUP_SCRIPT, BACKEND_DIR],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        first = [r["first_generate"] for r in runs]
+        results.append(
+            summarize(
+                "startup.first_generate",
+                first,
+                sum(first),
+                len(first),
+                variant=f"warmup={warmup}",
+                import_ms=round(percentile([r["import"] for r in runs], 50) * 1000, 3),
+                ready_ms=round(percentile([r["ready"] for r in runs], 50) * 1000, 3),
+            )
+        )
+        r = results[-1]
+        print(f"  warmup={warmup} import={r['import_ms']}ms ready={r['ready_ms']}ms first_generate={r['p50_ms']}ms")
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(r: Dict[str, Any]) -> str:
+        return f"{r['scenario']}[{r.get('rows', r.get('concurrency', r.get('layout', r.get('variant', ''))))}]"
+
+    before = {key(r): r for r in baseline.get("results", [])}
+    print(f"\nComparison against {baseline_path}:")
+    for r in current["results"]:
+        old = before.get(key(r))
+        if not old or not old.get("p50_ms"):
+            continue
+        ratio = r["p50_ms"] / old["p50_ms"]
+        print(f"  {key(r):45s} p50 {old['p50_ms']:>10.3f} -> {r['p50_ms']:>10.3f} ms  (x{ratio:.2f})")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the zero-chrono backend against a mock LLM.")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="CSV row counts to test.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed iterations per CSV/graph scenario.")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per /generate scenario.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent /generate clients.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock completion latency (s).")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Mock decode rate.")
+    parser.add_argument(
+        "--prefill-tokens-per-sec", type=float, default=2000.0, help="Mock prefill rate for uncached tokens."
+    )
+    parser.add_argument(
+        "--only",
+        default="csv,generate,graph,prefill,startup",
+        help="Comma-separated subset of suites to run (csv, generate, graph, prefill, startup).",
+    )
+    parser.add_argument("--out", default=None, help="Results JSON path (default: bench_results/<time>.json).")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare p50s against.")
+    args = parser.parse_args()
+
+    suites = {s.strip() for s in args.only.split(",") if s.strip()}
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    config = mock_lmstudio.MockConfig(
+        latency=args.latency,
+        tokens_per_sec=args.tokens_per_sec,
+        prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+    )
+    httpd = mock_lmstudio.serve(config)
+
+    work_dir = tempfile.mkdtemp(prefix="zc-bench-")
+    os.environ["LMSTUDIO_BASE_URL"] = mock_lmstudio.base_url(httpd)
+    os.environ["LMSTUDIO_MODEL"] = config.model
+    os.environ["CSV_CACHE_DIR"] = os.path.join(work_dir, "csv_cache")
+
+    results: List[Dict[str, Any]] = []
+    try:
+        if "csv" in suites:
+            print("CSV context builders:")
+            results += bench_csv_context(sizes, args.repeat, work_dir)
+        if "generate" in suites:
+            print("/generate:")
+            results += bench_generate(args.requests, args.concurrency)
+        if "graph" in suites:
+            print("/graph:")
+            results += bench_graph(args.repeat, work_dir)
+        if "prefill" in suites:
+            print("Prompt layout / prefill:")
+            results += bench_prefill(config, args.repeat, args.requests, work_dir)
+        if "startup" in suites:
+            print("Startup:")
+            results += bench_startup(args.repeat)
+    finally:
+        httpd.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "mock_requests": config.requests,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(
+        BACKEND_DIR, "bench_results", time.strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {out}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
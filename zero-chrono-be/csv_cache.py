@@ -0,0 +1,462 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import metrics
+
+# On-disk layout of a cache file:
+#   MAGIC | u32 header length | JSON header (space padded) | column blocks
+# Every column is a block of fixed-width codes. String columns are dictionary
+# encoded (codes index into a JSON list of distinct values); integer columns
+# are stored as int64 when every cell round-trips through int() unchanged and
+# fits in 64 bits.
+MAGIC = b"ZCC1"
+FORMAT_VERSION = 1
+_HEADER_PAD = 64
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+Predicate = Union[str, Sequence[str], Callable[[str], bool]]
+
+
+def cache_enabled() -> bool:
+    return os.getenv("CSV_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def cache_path_for(file_path: str, delimiter: str, cache_dir: Optional[str] = None) -> str:
+    """Return the cache file location for a CSV source and delimiter.
+
+    The name includes a short hash of the absolute source path, so files with
+    the same basename in different directories can share CSV_CACHE_DIR.
+    """
+    src = os.path.abspath(file_path)
+    cache_dir = cache_dir or os.getenv("CSV_CACHE_DIR") or os.path.join(os.path.dirname(src), ".csv_cache")
+    path_hash = hashlib.sha256(src.encode("utf-8")).hexdigest()[:12]
+    name = f"{os.path.basename(src)}.{path_hash}.{ord(delimiter[:1] or ','):02x}.zcc"
+    return os.path.join(cache_dir, name)
+
+
+def _sha256_file(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_stat(file_path: str) -> Dict[str, int]:
+    st = os.stat(file_path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _code_typecode(cardinality: int) -> str:
+    if cardinality <= 0xFF:
+        return "B"
+    if cardinality <= 0xFFFF:
+        return "H"
+    return "I"
+
+
+def _is_int_column(values: Sequence[str]) -> bool:
+    if not values:
+        return False
+    try:
+        for v in values:
+            n = int(v)
+            if str(n) != v or not _INT64_MIN <= n <= _INT64_MAX:
+                return False
+    except ValueError:
+        return False
+    return True
+
+
+def _encode_column(values: List[str]) -> Tuple[Dict[str, Any], bytes, bytes]:
+    """Return (column meta, code bytes, dictionary bytes)."""
+    if _is_int_column(values):
+        codes = array("q", (int(v) for v in values))
+        return {"kind": "int", "typecode": "q"}, codes.tobytes(), b""
+
+    lookup: Dict[str, int] = {}
+    dictionary: List[str] = []
+    raw_codes: List[int] = []
+    for v in values:
+        code = lookup.get(v)
+        if code is None:
+            code = len(dictionary)
+            lookup[v] = code
+            dictionary.append(v)
+        raw_codes.append(code)
+    typecode = _code_typecode(len(dictionary))
+    codes = array(typecode, raw_codes)
+    dict_bytes = json.dumps(dictionary, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {"kind": "dict", "typecode": typecode}, codes.tobytes(), dict_bytes
+
+
+def _write_header(f, header: Dict[str, Any], reserved: int) -> None:
+    raw = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) > reserved:
+        raise ValueError("Cache header does not fit in reserved space")
+    f.write(MAGIC)
+    f.write(reserved.to_bytes(4, "little"))
+    f.write(raw + b" " * (reserved - len(raw)))
+
+
+def ingest(file_path: str, delimiter: str = ",", cache_dir: Optional[str] = None) -> str:
+    """Parse a CSV once and write its columnar cache. Returns the cache path."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"CSV file not found: {file_path}")
+
+    stat = _source_stat(file_path)
+    digest = _sha256_file(file_path)
+
+    header: List[str] = []
+    rows: List[List[str]] = []
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        for idx, row in enumerate(reader):
+            if idx == 0:
+                header = [col.strip() for col in row]
+                continue
+            rows.append([cell.strip() for cell in row])
+
+    width = max((len(r) for r in rows), default=0)
+    widths = [len(r) for r in rows]
+    ragged = any(w != width for w in widths)
+
+    columns_meta: List[Dict[str, Any]] = []
+    blocks: List[bytes] = []
+    for col in range(width):
+        values = [r[col] if col < len(r) else "" for r in rows]
+        meta, code_bytes, dict_bytes = _encode_column(values)
+        columns_meta.append(meta)
+        blocks.append(code_bytes)
+        blocks.append(dict_bytes)
+    if ragged:
+        width_codes = array(_code_typecode(width), widths)
+        blocks.append(width_codes.tobytes())
+
+    meta_header: Dict[str, Any] = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "source": {"path": os.path.abspath(file_path), "sha256": digest, **stat},
+        "delimiter": delimiter,
+        "num_rows": len(rows),
+        "header": header,
+        "columns": columns_meta,
+        "widths": None,
+    }
+    # Offsets are relative to the start of the data section so they do not
+    # depend on the (padded) header length.
+    offset = 0
+    for i, meta in enumerate(columns_meta):
+        meta["offset"], meta["length"] = offset, len(blocks[2 * i])
+        offset += len(blocks[2 * i])
+        meta["dict_offset"], meta["dict_length"] = offset, len(blocks[2 * i + 1])
+        offset += len(blocks[2 * i + 1])
+    if ragged:
+        meta_header["widths"] = {"typecode": _code_typecode(width), "offset": offset, "length": len(blocks[-1])}
+
+    reserved = len(json.dumps(meta_header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")) + _HEADER_PAD
+    out_path = cache_path_for(file_path, delimiter, cache_dir)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        _write_header(f, meta_header, reserved)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def _read_meta(cache_path: str) -> Tuple[Dict[str, Any], int, int]:
+    """Return (header, reserved header length, data section offset)."""
+    with open(cache_path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"Not a CSV cache file: {cache_path}")
+        reserved = int.from_bytes(f.read(4), "little")
+        meta = json.loads(f.read(reserved).decode("utf-8"))
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported CSV cache version in {cache_path}")
+    return meta, reserved, 8 + reserved
+
+
+class ColumnarTable:
+    """Lazily loaded view over a cache file.
+
+    Only the JSON header is read up front; column codes and dictionaries are
+    read on first access, and only for the columns a query touches.
+    """
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        self.meta, _, self._data_offset = _read_meta(cache_path)
+        self.header: List[str] = list(self.meta["header"])
+        self.num_rows: int = int(self.meta["num_rows"])
+        self.num_columns: int = len(self.meta["columns"])
+        self._codes: Dict[int, array] = {}
+        self._dicts: Dict[int, List[str]] = {}
+        self._widths: Optional[array] = None
+        self._lock = threading.RLock()
+        # Keep the handle open so a concurrent re-ingest (which replaces the
+        # file) cannot change the bytes under an already-open table.
+        self._fh = open(cache_path, "rb")
+
+    def close(self) -> None:
+        """Close the file handle; later reads of unloaded columns raise ValueError."""
+        with self._lock:
+            self._fh.close()
+
+    def _read_block(self, offset: int, length: int) -> bytes:
+        with self._lock:
+            self._fh.seek(self._data_offset + offset)
+            return self._fh.read(length)
+
+    def _read_array(self, typecode: str, offset: int, length: int, count: Optional[int] = None) -> array:
+        arr = array(typecode)
+        if count is not None:
+            length = min(length, count * arr.itemsize)
+        arr.frombytes(self._read_block(offset, length))
+        if self.meta.get("byteorder") != sys.byteorder:
+            arr.byteswap()
+        return arr
+
+    def _column_codes(self, col: int, limit: Optional[int] = None) -> array:
+        codes = self._codes.get(col)
+        if codes is not None:
+            return codes
+        meta = self.meta["columns"][col]
+        if limit is not None and limit < self.num_rows:
+            # Partial reads are not memoized; only the prefix was fetched.
+            return self._read_array(meta["typecode"], meta["offset"], meta["length"], count=limit)
+        with self._lock:
+            codes = self._codes.get(col)
+            if codes is None:
+                codes = self._read_array(meta["typecode"], meta["offset"], meta["length"])
+                self._codes[col] = codes
+        return codes
+
+    def _dictionary(self, col: int) -> List[str]:
+        values = self._dicts.get(col)
+        if values is not None:
+            return values
+        meta = self.meta["columns"][col]
+        with self._lock:
+            values = self._dicts.get(col)
+            if values is None:
+                values = json.loads(self._read_block(meta["dict_offset"], meta["dict_length"]).decode("utf-8"))
+                self._dicts[col] = values
+        return values
+
+    def _row_widths(self) -> Optional[array]:
+        spec = self.meta.get("widths")
+        if not spec:
+            return None
+        if self._widths is None:
+            self._widths = self._read_array(spec["typecode"], spec["offset"], spec["length"])
+        return self._widths
+
+    def _decode(self, col: int, codes: Sequence[int]) -> List[str]:
+        if self.meta["columns"][col]["kind"] == "int":
+            return [str(c) for c in codes]
+        dictionary = self._dictionary(col)
+        return [dictionary[c] for c in codes]
+
+    def column_index(self, column: Union[int, str]) -> int:
+        if isinstance(column, int):
+            if 0 <= column < max(self.num_columns, len(self.header)):
+                return column
+            raise IndexError(f"Column index out of range: {column}")
+        lowered = column.strip().lower()
+        for i, name in enumerate(self.header):
+            if name.lower() == lowered:
+                return i
+        raise KeyError(f"Unknown column: {column}")
+
+    def _matching_rows(self, where: Dict[Union[int, str], Predicate], limit: Optional[int]) -> List[int]:
+        """Evaluate predicates against dictionaries first, then scan codes."""
+        candidates: Optional[List[int]] = None
+        for column, predicate in where.items():
+            col = self.column_index(column)
+            if callable(predicate):
+                test = predicate
+            elif isinstance(predicate, str):
+                test = predicate.__eq__
+            else:
+                allowed = set(predicate)
+                test = allowed.__contains__
+            pool = range(self.num_rows) if candidates is None else candidates
+            if col >= self.num_columns:
+                candidates = list(pool) if test("") else []
+                continue
+            codes = self._column_codes(col)
+            if self.meta["columns"][col]["kind"] == "dict":
+                keep = {i for i, v in enumerate(self._dictionary(col)) if test(v)}
+                match = lambda r, keep=keep, codes=codes: codes[r] in keep
+            else:
+                match = lambda r, test=test, codes=codes: test(str(codes[r]))
+            candidates = [r for r in pool if match(r)]
+        result = candidates if candidates is not None else list(range(self.num_rows))
+        return result[:limit] if limit is not None else result
+
+    def select(
+        self,
+        columns: Optional[Sequence[Union[int, str]]] = None,
+        where: Optional[Dict[Union[int, str], Predicate]] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[str], List[List[str]]]:
+        """Return (header, rows) for the projected columns and matching rows.
+
+        Without a projection the full, possibly ragged, rows are returned
+        exactly as the ``csv`` loader would have produced them.
+        """
+        projected = columns is not None
+        col_indices = [self.column_index(c) for c in columns] if projected else list(range(self.num_columns))
+        if where:
+            row_ids: Optional[List[int]] = self._matching_rows(where, limit)
+            n = len(row_ids)
+        else:
+            row_ids = None
+            n = self.num_rows if limit is None else max(0, min(limit, self.num_rows))
+
+        decoded: List[List[str]] = []
+        for col in col_indices:
+            if col >= self.num_columns:
+                # Header-only column: no row ever had a cell here.
+                decoded.append([""] * n)
+            elif row_ids is None:
+                codes = self._column_codes(col, limit=n)
+                decoded.append(self._decode(col, codes[:n]))
+            else:
+                codes = self._column_codes(col)
+                decoded.append(self._decode(col, [codes[r] for r in row_ids]))
+
+        rows: List[List[str]] = [list(cells) for cells in zip(*decoded)] if decoded else [[] for _ in range(n)]
+        widths = None if projected else self._row_widths()
+        if widths is not None:
+            ids = row_ids if row_ids is not None else range(n)
+            rows = [row[: widths[r]] for row, r in zip(rows, ids)]
+
+        if projected:
+            header = [self.header[i] if i < len(self.header) else "" for i in col_indices]
+        else:
+            header = list(self.header)
+        return header, rows
+
+
+_TABLES: Dict[Tuple[str, str], Tuple[Tuple[int, int], ColumnarTable]] = {}
+# Sources whose ingest failed, by stamp, so callers fall back straight away
+# instead of re-parsing the file on every call until it changes.
+_FAILED: Dict[Tuple[str, str], Tuple[Tuple[int, int], str]] = {}
+_TABLES_LOCK = threading.Lock()
+# One lock per source: an ingest only blocks loads of the same file.
+_KEY_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def _is_fresh(cache_path: str, file_path: str, stat: Dict[str, int]) -> bool:
+    """Check a cache file against its source, refreshing stale mtimes in place."""
+    try:
+        meta, reserved, _ = _read_meta(cache_path)
+    except (OSError, ValueError):
+        return False
+    source = meta.get("source") or {}
+    if source.get("path") != os.path.abspath(file_path):
+        return False
+    if source.get("mtime_ns") == stat["mtime_ns"] and source.get("size") == stat["size"]:
+        return True
+    if source.get("size") != stat["size"] or source.get("sha256") != _sha256_file(file_path):
+        return False
+    # Content unchanged (e.g. file touched or re-copied): record the new mtime
+    # so later checks stay on the cheap stat path.
+    meta["source"].update(stat)
+    try:
+        with open(cache_path, "r+b") as f:
+            _write_header(f, meta, reserved)
+    except (OSError, ValueError):
+        pass
+    return True
+
+
+def open_table(file_path: str, delimiter: str = ",", cache_dir: Optional[str] = None) -> ColumnarTable:
+    """Return a ColumnarTable for file_path, ingesting it if the cache is stale."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"CSV file not found: {file_path}")
+    stat = _source_stat(file_path)
+    key = (os.path.abspath(file_path), delimiter)
+    stamp = (stat["mtime_ns"], stat["size"])
+    with _TABLES_LOCK:
+        key_lock = _KEY_LOCKS.setdefault(key, threading.Lock())
+    with key_lock:
+        entry = _TABLES.get(key)
+        if entry is not None and entry[0] == stamp:
+            metrics.CACHE_EVENTS.inc(cache="csv", result="memory")
+            return entry[1]
+        failed = _FAILED.get(key)
+        if failed is not None and failed[0] == stamp:
+            metrics.CACHE_EVENTS.inc(cache="csv", result="failed")
+            raise ValueError(f"CSV cache unavailable for {file_path}: {failed[1]}")
+        cache_path = cache_path_for(file_path, delimiter, cache_dir)
+        try:
+            if _is_fresh(cache_path, file_path, stat):
+                metrics.CACHE_EVENTS.inc(cache="csv", result="hit")
+            else:
+                metrics.CACHE_EVENTS.inc(cache="csv", result="miss")
+                with metrics.span("csv_ingest", file=os.path.basename(file_path)):
+                    cache_path = ingest(file_path, delimiter, cache_dir)
+            table = ColumnarTable(cache_path)
+        except (OSError, ValueError, OverflowError) as exc:
+            _FAILED[key] = (stamp, str(exc))
+            raise
+        _FAILED.pop(key, None)
+        with _TABLES_LOCK:
+            _TABLES[key] = (stamp, table)
+        if entry is not None:
+            entry[1].close()
+        return table
+
+
+def clear_tables() -> None:
+    """Close and forget every open table (tests, benchmarks)."""
+    with _TABLES_LOCK:
+        entries = list(_TABLES.values())
+        _TABLES.clear()
+        _FAILED.clear()
+    for _, table in entries:
+        table.close()
+
+
+def load_head_rows(
+    file_path: str,
+    delimiter: str,
+    max_rows: int,
+    columns: Optional[Sequence[Union[int, str]]] = None,
+    where: Optional[Dict[Union[int, str], Predicate]] = None,
+) -> Tuple[List[str], List[List[str]]]:
+    """Cache-backed equivalent of lm_test._load_csv_head_rows."""
+    table = open_table(file_path, delimiter)
+    return table.select(columns=columns, where=where, limit=max_rows)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build columnar caches for clinical CSV extracts.")
+    parser.add_argument("csv_files", nargs="+", help="CSV files to ingest.")
+    parser.add_argument("--csv-delimiter", default=",", help="CSV delimiter (default: ',').")
+    parser.add_argument("--cache-dir", default=None, help="Cache directory (default: <csv dir>/.csv_cache).")
+    args = parser.parse_args()
+
+    for path in args.csv_files:
+        try:
+            out = ingest(path, args.csv_delimiter, args.cache_dir)
+        except Exception as exc:
+            print(f"Error ingesting {path}: {exc}", file=sys.stderr)
+            return 1
+        print(f"{path} -> {out} ({os.path.getsize(out)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
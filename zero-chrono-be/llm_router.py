@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+import lm_test
+import metrics
+
+BACKEND_INFLIGHT = metrics.gauge("zc_backend_inflight", "In-flight requests per LLM backend.", ("backend",))
+BACKEND_HEALTHY = metrics.gauge("zc_backend_healthy", "1 if the last health probe succeeded.", ("backend",))
+BACKEND_LATENCY = metrics.gauge(
+    "zc_backend_latency_ewma_seconds", "EWMA completion latency per LLM backend.", ("backend",)
+)
+BACKEND_REQUESTS = metrics.counter(
+    "zc_backend_requests_total", "Completions per LLM backend by result.", ("backend", "result")
+)
+
+
+def is_backend_fault(exc: BaseException) -> bool:
+    """True for transport, timeout and 5xx errors, i.e. worth failing over.
+
+    Errors caused by the request itself (4xx, empty content) are not: they
+    would fail the same way on every backend.
+    """
+    import openai
+
+    for err in (exc, exc.__cause__):
+        if isinstance(err, (openai.APIConnectionError, ConnectionError, TimeoutError)):
+            return True
+        if isinstance(err, openai.APIStatusError):
+            return err.status_code >= 500
+    return False
+
+
+def is_timeout(exc: BaseException) -> bool:
+    """True if the call ran out of time (client timeout or router deadline)."""
+    import openai
+
+    return isinstance(exc, (openai.APITimeoutError, TimeoutError))
+
+
+class Backend:
+    """One OpenAI-compatible endpoint and its load/health bookkeeping."""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.inflight = 0
+        self.ewma_latency: Optional[float] = None
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+        # First model reported by /models; saves an auto-detect per request.
+        self.model: Optional[str] = None
+
+    def score(self, default_latency: float) -> float:
+        """Expected completion time if one more request is sent here."""
+        return (self.inflight + 1) * (self.ewma_latency or default_latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "ewma_latency_s": self.ewma_latency,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "model": self.model,
+        }
+
+
+class BackendPool:
+    """Routes completions to the least-loaded healthy backend, with failover."""
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        api_key: str = "lm-studio",
+        probe_interval: float = 10.0,
+        probe_timeout: float = 2.0,
+        max_failures: int = 2,
+    ) -> None:
+        if not base_urls:
+            raise ValueError("BackendPool needs at least one base URL")
+        self.backends = [Backend(u) for u in base_urls]
+        self.api_key = api_key
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_failures = max(1, max_failures)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for b in self.backends:
+            BACKEND_HEALTHY.set(1, backend=b.base_url)
+
+    @classmethod
+    def from_env(cls) -> "BackendPool":
+        urls = os.getenv("LMSTUDIO_BASE_URLS") or os.getenv("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
+        return cls(
+            [u.strip() for u in urls.split(",") if u.strip()],
+            api_key=os.getenv("LMSTUDIO_API_KEY", "lm-studio"),
+            probe_interval=float(os.getenv("LLM_HEALTH_INTERVAL_S", "10")),
+        )
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    # --- Health checks ---
+    def probe(self, backend: Backend) -> bool:
+        req = urllib.request.Request(
+            f"{backend.base_url}/models", headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.probe_timeout) as resp:
+                payload = json.loads(resp.read() or b"{}")
+            models = payload.get("data") or []
+            ok = True
+            error = None
+        except Exception as exc:
+            models, ok, error = [], False, str(exc)
+        with self._lock:
+            backend.last_probe = time.time()
+            backend.healthy = ok
+            if ok:
+                backend.consecutive_failures = 0
+                if models and isinstance(models[0], dict) and models[0].get("id"):
+                    backend.model = models[0]["id"]
+            else:
+                backend.last_error = error
+        BACKEND_HEALTHY.set(1 if ok else 0, backend=backend.base_url)
+        return ok
+
+    def probe_all(self) -> None:
+        for backend in self.backends:
+            self.probe(backend)
+
+    def _probe_loop(self) -> None:
+        while True:
+            self.probe_all()
+            if self._stop.wait(self.probe_interval):
+                return
+
+    def start(self) -> None:
+        """Start background health probing (no-op for a single backend)."""
+        if self._thread is not None or len(self.backends) < 2 or self.probe_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._probe_loop, name="llm-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # --- Dispatch ---
+    def _ranked(self) -> List[Backend]:
+        """Healthy backends by score, then unhealthy ones as a last resort."""
+        with self._lock:
+            known = [b.ewma_latency for b in self.backends if b.ewma_latency]
+            default = min(known) if known else 1.0
+            return sorted(self.backends, key=lambda b: (not b.healthy, b.score(default)))
+
+    def _begin(self, backend: Backend) -> None:
+        with self._lock:
+            backend.inflight += 1
+        BACKEND_INFLIGHT.set(backend.inflight, backend=backend.base_url)
+
+    def _finish(
+        self, backend: Backend, latency: float, error: Optional[Exception], count: bool = True
+    ) -> None:
+        """Release an in-flight slot; `count=False` leaves health and latency alone."""
+        with self._lock:
+            backend.inflight = max(0, backend.inflight - 1)
+            if count and error is None:
+                backend.ewma_latency = (
+                    latency if backend.ewma_latency is None else 0.8 * backend.ewma_latency + 0.2 * latency
+                )
+                backend.consecutive_failures = 0
+                backend.healthy = True
+            elif count:
+                backend.consecutive_failures += 1
+                backend.last_error = str(error)
+                if backend.consecutive_failures >= self.max_failures:
+                    backend.healthy = False
+        BACKEND_INFLIGHT.set(backend.inflight, backend=backend.base_url)
+        BACKEND_HEALTHY.set(1 if backend.healthy else 0, backend=backend.base_url)
+        if backend.ewma_latency is not None:
+            BACKEND_LATENCY.set(backend.ewma_latency, backend=backend.base_url)
+        result = "ok" if error is None else "error"
+        BACKEND_REQUESTS.inc(backend=backend.base_url, result=result if count else "rejected")
+
+    def complete(
+        self,
+        prompt_text: str,
+        model: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        timeout: Optional[float] = None,
+        system_text: Optional[str] = None,
+    ) -> Tuple[str, str]:
+        """Same contract as lm_test._generate_completion, across the pool.
+
+        Tries backends from least to most loaded until one succeeds or the
+        timeout is spent; re-raises the last error. Request errors (see
+        is_backend_fault) are re-raised at once and do not count against
+        the backend's health. Neither does a timeout when `timeout` was set:
+        that is the caller's own deadline running out, not a slow backend.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        last_exc: Optional[Exception] = None
+        for backend in self._ranked():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            self._begin(backend)
+            start = time.monotonic()
+            try:
+                result = lm_test._generate_completion(
+                    prompt_text=prompt_text,
+                    base_url=backend.base_url,
+                    api_key=self.api_key,
+                    model=model or backend.model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=remaining,
+                    system_text=system_text,
+                )
+            except Exception as exc:
+                if not is_backend_fault(exc) or (deadline is not None and is_timeout(exc)):
+                    self._finish(backend, time.monotonic() - start, None, count=False)
+                    raise
+                self._finish(backend, time.monotonic() - start, exc)
+                metrics.log_event("backend_failover", backend=backend.base_url, error=str(exc))
+                last_exc = exc
+                continue
+            self._finish(backend, time.monotonic() - start, None)
+            return result
+        if last_exc is not None:
+            raise last_exc
+        raise TimeoutError("Deadline passed before any LLM backend was tried")
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.snapshot() for b in self.backends]
@@ -4,11 +4,25 @@ import os
 import re
 import sys
 import io
-from typing import List, Optional, Sequence, Tuple
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
-from openai import OpenAI
 from flask import Flask, request, jsonify
 
+if TYPE_CHECKING:  # openai is imported lazily; it dominates import time
+    from openai import OpenAI
+
+import csv_cache
+import metrics
+
+
+# Static preamble for CSV context. Kept separate from the table so it can be
+# sent as a system message ahead of the variable data (see prompt_layout).
+CSV_CONTEXT_INSTRUCTIONS = (
+    "You are given a CSV-derived context table.\n"
+    "Use this table as authoritative context if it answers the question.\n\n"
+)
+
 
 def read_text_file(file_path: str) -> str:
     if not os.path.exists(file_path):
@@ -17,7 +31,28 @@ def read_text_file(file_path: str) -> str:
         return f.read().strip()
 
 
-def resolve_model(client: OpenAI, explicit_model: Optional[str]) -> str:
+# Clients are cached per (base_url, api_key) so HTTP connections are pooled
+# across calls; auto-detected model names are cached per base_url.
+_CLIENTS: Dict[Tuple[str, str], "OpenAI"] = {}
+_CLIENTS_LOCK = threading.Lock()
+_DETECTED_MODELS: Dict[str, str] = {}
+
+
+def get_client(base_url: str, api_key: str) -> "OpenAI":
+    key = (base_url, api_key)
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                from openai import OpenAI
+
+                client = OpenAI(base_url=base_url, api_key=api_key)
+                _CLIENTS[key] = client
+    return client
+
+
+def resolve_model(client: "OpenAI", explicit_model: Optional[str]) -> str:
     if explicit_model:
         return explicit_model
 
@@ -26,17 +61,29 @@ def resolve_model(client: OpenAI, explicit_model: Optional[str]) -> str:
         return env_model
 
     # Best-effort auto-detect of the first available model
+    detect_error: Optional[Exception] = None
     try:
         models = client.models.list()
         if getattr(models, "data", None):
             return models.data[0].id
-    except Exception:
-        pass
+    except Exception as exc:
+        detect_error = exc
 
     raise RuntimeError(
         "No model specified and unable to auto-detect. "
         "Pass --model, or set LMSTUDIO_MODEL."
-    )
+    ) from detect_error
+
+
+def _resolve_model_cached(client: "OpenAI", base_url: str, explicit_model: Optional[str]) -> str:
+    if explicit_model or os.getenv("LMSTUDIO_MODEL"):
+        return resolve_model(client, explicit_model)
+    cached = _DETECTED_MODELS.get(base_url)
+    if cached:
+        return cached
+    model_name = resolve_model(client, None)
+    _DETECTED_MODELS[base_url] = model_name
+    return model_name
 
 
 def _split_words(text: str) -> List[str]:
@@ -55,6 +102,13 @@ def _load_csv_head_rows(
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"CSV file not found: {file_path}")
 
+    if csv_cache.cache_enabled():
+        try:
+            return csv_cache.load_head_rows(file_path, delimiter, max_rows)
+        except Exception:
+            # Cache unavailable (e.g. read-only data dir); parse the CSV text.
+            pass
+
     header: List[str] = []
     rows: List[List[str]] = []
     with open(file_path, "r", encoding="utf-8", newline="") as f:
@@ -187,6 +241,7 @@ def _build_csv_context_from_components(
     rows: Sequence[Sequence[str]],
     rag_columns: Optional[str],
     rag_max_chars: int,
+    include_instructions: bool = True,
 ) -> str:
     col_indices = _select_column_indices(header, rag_columns)
     selected_indices = list(range(len(rows)))
@@ -197,11 +252,8 @@ def _build_csv_context_from_components(
         col_indices=col_indices,
         max_chars=max(500, rag_max_chars),
     )
-    return (
-        "You are given a CSV-derived context table.\n"
-        "Use this table as authoritative context if it answers the question.\n\n"
-        f"CSV Context (all {len(selected_indices)} rows):\n{table}\n\n"
-    )
+    block = f"CSV Context (all {len(selected_indices)} rows):\n{table}\n\n"
+    return CSV_CONTEXT_INSTRUCTIONS + block if include_instructions else block
 
 
 def _build_csv_context_from_file(
@@ -210,7 +262,32 @@ def _build_csv_context_from_file(
     csv_max_rows: int,
     rag_columns: Optional[str],
     rag_max_chars: int,
+    include_instructions: bool = True,
 ) -> str:
+    if csv_cache.cache_enabled():
+        try:
+            table = csv_cache.open_table(file_path, delimiter)
+            # Push the column selection down to the cache so only the
+            # projected columns are read and decoded.
+            col_indices = _select_column_indices(table.header, rag_columns)
+            cached: Optional[Tuple[List[str], List[List[str]]]] = table.select(
+                columns=col_indices or None, limit=max(1, csv_max_rows)
+            )
+        except FileNotFoundError:
+            raise
+        except Exception:
+            # Cache unavailable, or the table was replaced mid-read; parse the CSV.
+            cached = None
+        if cached is not None:
+            header, rows = cached
+            return _build_csv_context_from_components(
+                header=header,
+                rows=rows,
+                rag_columns="*",
+                rag_max_chars=rag_max_chars,
+                include_instructions=include_instructions,
+            )
+
     header, rows = _load_csv_head_rows(
         file_path=file_path,
         delimiter=delimiter,
@@ -221,6 +298,7 @@ def _build_csv_context_from_file(
         rows=rows,
         rag_columns=rag_columns,
         rag_max_chars=rag_max_chars,
+        include_instructions=include_instructions,
     )
 
 
@@ -230,6 +308,7 @@ def _build_csv_context_from_text(
     csv_max_rows: int,
     rag_columns: Optional[str],
     rag_max_chars: int,
+    include_instructions: bool = True,
 ) -> str:
     header, rows = _load_csv_head_rows_from_text(
         csv_text=csv_text,
@@ -241,6 +320,7 @@ def _build_csv_context_from_text(
         rows=rows,
         rag_columns=rag_columns,
         rag_max_chars=rag_max_chars,
+        include_instructions=include_instructions,
     )
 
 
@@ -251,25 +331,52 @@ def _generate_completion(
     model: Optional[str],
     temperature: float,
     max_tokens: int,
+    timeout: Optional[float] = None,
+    system_text: Optional[str] = None,
 ) -> Tuple[str, str]:
-    """Returns (content, model_used). Raises on error."""
-    client = OpenAI(base_url=base_url, api_key=api_key)
-    model_name = resolve_model(client, model)
-    # Print before querying the LM
-    try:
-        preview = (prompt_text or "")[:200].replace("\n", " ")
-        print(
-            f"[LM] Querying model={model_name} temp={temperature} max_tokens={max_tokens} "
-            f"prompt_chars={len(prompt_text or '')} preview={preview}"
-        )
-    except Exception:
-        pass
-    response = client.chat.completions.create(
+    """Returns (content, model_used). Raises on error.
+
+    `timeout` bounds the HTTP call in seconds; None keeps the client default.
+    `system_text`, if given, is sent as a system message before the prompt.
+    """
+    client = get_client(base_url, api_key)
+    if timeout is not None:
+        client = client.with_options(timeout=timeout, max_retries=0)
+    model_name = _resolve_model_cached(client, base_url, model)
+    messages = [{"role": "user", "content": prompt_text}]
+    if system_text:
+        messages.insert(0, {"role": "system", "content": system_text})
+    # The span's log line replaces the old "[LM] Querying" print; it carries
+    # no prompt text, since prompts embed patient data.
+    with metrics.span(
+        "llm",
         model=model_name,
-        messages=[{"role": "user", "content": prompt_text}],
         temperature=temperature,
         max_tokens=max_tokens,
-    )
+        prompt_chars=len(prompt_text or ""),
+    ) as span_fields:
+        try:
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        except Exception:
+            # The served model may have changed; re-detect on the next call.
+            _DETECTED_MODELS.pop(base_url, None)
+            raise
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            for kind in ("prompt_tokens", "completion_tokens"):
+                count = getattr(usage, kind, None)
+                if count:
+                    metrics.LLM_TOKENS.inc(count, kind=kind.split("_")[0])
+                    span_fields[kind] = count
+            cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+            if cached:
+                metrics.LLM_TOKENS.inc(cached, kind="cached")
+                span_fields["cached_tokens"] = cached
     content = getattr(response.choices[0].message, "content", None) if response and response.choices else None
     if not content:
         raise RuntimeError("No content returned.")
@@ -455,7 +562,7 @@ def main() -> int:
         print(f"Error reading prompt file: {exc}", file=sys.stderr)
         return 1
 
-    client = OpenAI(base_url=args.base_url, api_key=args.api_key)
+    client = get_client(args.base_url, args.api_key)
 
     try:
         model_name = resolve_model(client, args.model)
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import metrics
+
+# "legacy": one user message, variable context first (the original layout).
+# "prefix": static instructions/templates in a system message, variable data
+# after them, so consecutive requests share a long byte-identical prefix and
+# the inference server's prompt (KV) cache can skip most of the prefill.
+# /generate already sends instructions, table, question in that order, so the
+# two layouts only differ in roles there; its cache gain comes from reusing a
+# byte-identical table via PinnedContexts (context_id).
+LAYOUT_LEGACY = "legacy"
+LAYOUT_PREFIX = "prefix"
+LAYOUTS = (LAYOUT_LEGACY, LAYOUT_PREFIX)
+
+
+def layout_from_env(default: str = LAYOUT_LEGACY) -> str:
+    layout = os.getenv("PROMPT_LAYOUT", default).strip().lower()
+    return layout if layout in LAYOUTS else default
+
+
+def assemble(
+    layout: str,
+    instructions: str,
+    data: str,
+    question: str = "",
+) -> Tuple[Optional[str], str]:
+    """Return (system_text, user_text) for a prompt made of three parts.
+
+    `instructions` is static text (preambles, prompt templates), `data` is
+    the variable context, `question` is the per-request user prompt. The
+    legacy layout reproduces the original single-message byte order:
+    data-preamble + data + question.
+    """
+    if layout == LAYOUT_PREFIX:
+        return instructions or None, f"{data}{question}"
+    return None, f"{instructions}{data}{question}"
+
+
+class PinnedContexts:
+    """Named context blocks kept byte-identical across requests.
+
+    A client pins a rendered block once and references it by ID afterwards,
+    so the same bytes (and therefore the same cached prefix) are sent to the
+    model every time. Least recently used blocks are evicted past capacity.
+    """
+
+    def __init__(self, capacity: int = 32) -> None:
+        self.capacity = max(1, capacity)
+        self._blocks: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "PinnedContexts":
+        return cls(int(os.getenv("PINNED_CONTEXTS_MAX", "32")))
+
+    def pin(self, context_id: str, block: str) -> str:
+        with self._lock:
+            existing = self._blocks.get(context_id)
+            if existing == block:
+                self._blocks.move_to_end(context_id)
+                return existing
+            self._blocks[context_id] = block
+            self._blocks.move_to_end(context_id)
+            while len(self._blocks) > self.capacity:
+                self._blocks.popitem(last=False)
+        return block
+
+    def get(self, context_id: str) -> Optional[str]:
+        with self._lock:
+            block = self._blocks.get(context_id)
+            if block is not None:
+                self._blocks.move_to_end(context_id)
+        metrics.CACHE_EVENTS.inc(cache="pinned_context", result="hit" if block is not None else "miss")
+        return block
+
+    def __len__(self) -> int:
+        return len(self._blocks)
@@ -0,0 +1,203 @@
+import glob
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+# Placeholders look like <PATIENT_LABS>: upper-case name in angle brackets.
+_PLACEHOLDER_RE = re.compile(r"<([A-Z][A-Z0-9_]*)>")
+# Rough BPE-like token estimate: words, punctuation, and each newline plus
+# its indentation run. Good enough to compare two renderings of one prompt.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]|\n[ \t]*")
+
+PROMPT_RENDERS = metrics.counter("zc_prompt_renders_total", "Prompt template renders.", ("template",))
+PROMPT_TOKENS = metrics.counter(
+    "zc_prompt_tokens_estimated_total", "Estimated tokens in sampled prompt renders.", ("template",)
+)
+PROMPT_TOKENS_SAVED = metrics.counter(
+    "zc_prompt_tokens_saved_total", "Estimated tokens saved versus indented JSON, sampled renders.", ("template",)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return len(_TOKEN_RE.findall(text))
+
+
+def _prune(value: Any, drop_fields: Iterable[str]) -> Any:
+    drop = set(drop_fields)
+    if isinstance(value, dict):
+        return {k: _prune(v, drop) for k, v in value.items() if k not in drop}
+    if isinstance(value, list):
+        return [_prune(v, drop) for v in value]
+    return value
+
+
+def compact_json(value: Any, drop_fields: Optional[Iterable[str]] = None) -> str:
+    """Serialize data for embedding in a prompt: no indentation, no padding."""
+    if drop_fields:
+        value = _prune(value, drop_fields)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class PromptTemplate:
+    """A prompt file pre-split into literal text and placeholder names."""
+
+    def __init__(self, name: str, path: str, text: str, mtime_ns: int) -> None:
+        self.name = name
+        self.path = path
+        self.text = text
+        self.mtime_ns = mtime_ns
+        # Even indices are literals, odd indices are placeholder names.
+        self.parts: List[str] = _PLACEHOLDER_RE.split(text)
+        self.placeholders: List[str] = self.parts[1::2]
+
+    def render(self, values: Dict[str, Any], drop_fields: Optional[Iterable[str]] = None) -> str:
+        """Fill all placeholders in a single pass.
+
+        Non-string values are embedded as compact JSON. Placeholders without a
+        value are left untouched, matching the old str.replace() behaviour.
+        """
+        out: List[str] = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                out.append(part)
+            elif part in values:
+                value = values[part]
+                out.append(value if isinstance(value, str) else compact_json(value, drop_fields))
+            else:
+                out.append(f"<{part}>")
+        return "".join(out)
+
+    def render_sections(self, values: Dict[str, Any], drop_fields: Optional[Iterable[str]] = None) -> str:
+        """Render only the placeholder values, as labelled sections.
+
+        Used with the prefix-cache layout: the template text is sent verbatim
+        (placeholders act as labels) and the data follows it.
+        """
+        out: List[str] = []
+        for name in self.placeholders:
+            if name not in values:
+                continue
+            value = values[name]
+            rendered = value if isinstance(value, str) else compact_json(value, drop_fields)
+            out.append(f"<{name}>\n{rendered}\n")
+        return "\n".join(out)
+
+    def render_indented(self, values: Dict[str, Any]) -> str:
+        """Render with indent=2 JSON; used as the baseline for token savings."""
+        indented = {
+            k: v if isinstance(v, str) else json.dumps(v, ensure_ascii=False, indent=2)
+            for k, v in values.items()
+        }
+        return self.render(indented)
+
+
+class TemplateRegistry:
+    """Loads prompts/*.txt once and reloads a template when its file changes.
+
+    Token statistics need a second, indented rendering, so they are only
+    computed for the first render of each template and then one render in
+    `sample_every` (0 disables them).
+    """
+
+    def __init__(self, prompts_dir: str, preload: bool = True, sample_every: Optional[int] = None) -> None:
+        self.prompts_dir = os.path.abspath(prompts_dir)
+        if sample_every is None:
+            sample_every = int(os.getenv("PROMPT_STATS_SAMPLE_EVERY", "10"))
+        self.sample_every = max(0, sample_every)
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        if preload:
+            for path in sorted(glob.glob(os.path.join(self.prompts_dir, "*.txt"))):
+                self.get(path)
+
+    def _resolve(self, name_or_path: str) -> Tuple[str, str]:
+        if os.path.isabs(name_or_path) or os.sep in name_or_path:
+            path = os.path.abspath(name_or_path)
+        else:
+            filename = name_or_path if name_or_path.endswith(".txt") else f"{name_or_path}.txt"
+            path = os.path.join(self.prompts_dir, filename)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return name, path
+
+    def get(self, name_or_path: str) -> PromptTemplate:
+        """Return a template by name ("linker_prompt") or file path."""
+        name, path = self._resolve(name_or_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Prompt file not found: {path}")
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._templates.get(path)
+        if cached is not None and cached.mtime_ns == mtime_ns:
+            metrics.CACHE_EVENTS.inc(cache="prompt_template", result="hit")
+            return cached
+        metrics.CACHE_EVENTS.inc(cache="prompt_template", result="miss")
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        template = PromptTemplate(name, path, text, mtime_ns)
+        with self._lock:
+            self._templates[path] = template
+        return template
+
+    def render(
+        self,
+        name_or_path: str,
+        values: Dict[str, Any],
+        drop_fields: Optional[Iterable[str]] = None,
+    ) -> str:
+        template = self.get(name_or_path)
+        rendered = template.render(values, drop_fields)
+        self._record(template, rendered, values)
+        return rendered
+
+    def render_split(
+        self,
+        name_or_path: str,
+        values: Dict[str, Any],
+        drop_fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[str, str]:
+        """Return (static template text, rendered data sections)."""
+        template = self.get(name_or_path)
+        sections = template.render_sections(values, drop_fields)
+        self._record(template, template.text + sections, values)
+        return template.text, sections
+
+    def _record(self, template: PromptTemplate, rendered: str, values: Dict[str, Any]) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(
+                template.name, {"renders": 0, "sampled": 0, "tokens": 0, "baseline_tokens": 0}
+            )
+            stats["renders"] += 1
+            sample = self.sample_every > 0 and (stats["renders"] - 1) % self.sample_every == 0
+        PROMPT_RENDERS.inc(template=template.name)
+        if not sample:
+            metrics.log_event("prompt_render", template=template.name, chars=len(rendered))
+            return
+        tokens = estimate_tokens(rendered)
+        baseline = estimate_tokens(template.render_indented(values))
+        with self._lock:
+            stats["sampled"] += 1
+            stats["tokens"] += tokens
+            stats["baseline_tokens"] += baseline
+        PROMPT_TOKENS.inc(tokens, template=template.name)
+        PROMPT_TOKENS_SAVED.inc(baseline - tokens, template=template.name)
+        metrics.log_event(
+            "prompt_render",
+            template=template.name,
+            chars=len(rendered),
+            est_tokens=tokens,
+            saved_vs_indented=baseline - tokens,
+        )
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """Per-template render counts and estimated token savings over sampled renders."""
+        with self._lock:
+            return {
+                name: {**stats, "tokens_saved": stats["baseline_tokens"] - stats["tokens"]}
+                for name, stats in self._stats.items()
+            }
@@ -1,33 +1,180 @@
+import time
+
+# Taken before the other imports so startup import time can be reported.
+_IMPORT_START = time.perf_counter()
+
 import os
 import re
 import json
 import sys
-from typing import Dict, Any, Tuple
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, g
 
 # Ensure we can import sibling lm_test.py regardless of package name
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 if CURRENT_DIR not in sys.path:
     sys.path.append(CURRENT_DIR)
+# lm_test imports openai lazily, on the first LLM call or during warm-up
 import lm_test  # type: ignore
+import csv_cache  # type: ignore
+import prompt_templates  # type: ignore
+import metrics  # type: ignore
+import admission  # type: ignore
+import llm_router  # type: ignore
+import prompt_layout  # type: ignore
+
+HTTP_SECONDS = metrics.histogram(
+    "zc_http_request_duration_seconds", "HTTP request latency by endpoint.", ("endpoint", "status")
+)
+STARTUP_SECONDS = metrics.gauge("zc_startup_seconds", "Duration of each startup phase.", ("phase",))
+FIRST_REQUEST_SECONDS = metrics.gauge(
+    "zc_first_request_seconds", "Latency of the first request served per endpoint.", ("endpoint",)
+)
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
+
+# /ready stays 503 if any of these warm-up steps failed: the service
+# cannot answer LLM requests without a reachable, responding backend.
+WARMUP_REQUIRED_STEPS = ("models", "completion")
+
+
+def _default_graph_root() -> str:
+    return os.getenv("GRAPH_ROOT") or os.path.abspath(os.path.join(CURRENT_DIR, os.pardir, os.pardir))
 
 
 def create_main_app() -> Flask:
+    create_start = time.perf_counter()
     app = Flask(__name__)
+    templates = prompt_templates.TemplateRegistry(os.path.join(CURRENT_DIR, "prompts"))
+    # Optional comma-separated node fields to leave out of the linker prompt
+    prune_fields = [f.strip() for f in os.getenv("PROMPT_PRUNE_FIELDS", "").split(",") if f.strip()]
+    # Shared admission control in front of the LLM: interactive /generate
+    # calls are queued ahead of background graph builds.
+    limiter = admission.AdmissionController.from_env()
+    # One or more OpenAI-compatible endpoints (LMSTUDIO_BASE_URLS, comma-separated)
+    backends = llm_router.BackendPool.from_env()
+    backends.start()
+    # Prompt assembly order (PROMPT_LAYOUT=legacy|prefix) and pinned contexts
+    default_layout = prompt_layout.layout_from_env()
+    pinned = prompt_layout.PinnedContexts.from_env()
+    generate_deadline = float(os.getenv("GENERATE_DEADLINE_S", "120"))
+    graph_deadline = float(os.getenv("GRAPH_DEADLINE_S", "600"))
+
+    first_seen: set = set()
+    first_seen_lock = threading.Lock()
+    # graph.json (path, mtime, size) -> transformed /graph payload
+    graph_cache: Dict[str, Any] = {}
+
+    def _rejected_response(exc: admission.Rejected):
+        response = jsonify({"error": str(exc)})
+        if exc.retry_after:
+            response.headers["Retry-After"] = str(max(1, int(exc.retry_after + 0.5)))
+        return response, exc.status
+
+    def _is_congestion(exc: BaseException) -> bool:
+        """Backend faults and timeouts shrink the admission limit; request errors do not."""
+        return llm_router.is_backend_fault(exc) or llm_router.is_timeout(exc)
+
+    def _complete(priority: int, timeout_s: float, **kwargs: Any) -> Tuple[str, str]:
+        """Run one completion under an admission slot and deadline.
+
+        A completion that runs out of time is reported as DeadlineExceeded
+        (503) rather than a generic error.
+        """
+        with limiter.slot(priority, timeout_s, is_congestion=_is_congestion) as deadline:
+            try:
+                return backends.complete(timeout=admission.remaining(deadline), **kwargs)
+            except Exception as exc:
+                if llm_router.is_timeout(exc):
+                    raise admission.DeadlineExceeded("Deadline passed waiting for the LLM") from exc
+                raise
+
+    # --- Per-request trace IDs ---
+    @app.before_request
+    def start_request_trace() -> None:
+        g.trace_token = metrics.start_trace(request.headers.get("X-Request-ID"))
+        g.request_start = time.perf_counter()
+
+    @app.teardown_request
+    def end_request_trace(_exc) -> None:
+        token = g.pop("trace_token", None)
+        if token is not None:
+            metrics.end_trace(token)
 
     # --- Simple CORS ---
     @app.after_request
     def add_cors_headers(response):  # type: ignore[override]
         response.headers["Access-Control-Allow-Origin"] = os.getenv("CORS_ALLOW_ORIGIN", "*")
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Request-ID"
         response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
         return response
 
+    @app.after_request
+    def record_request(response):  # type: ignore[override]
+        start = g.get("request_start")
+        if start is not None:
+            elapsed = time.perf_counter() - start
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_SECONDS.observe(elapsed, endpoint=endpoint, status=response.status_code)
+            with first_seen_lock:
+                is_first = endpoint not in first_seen
+                first_seen.add(endpoint)
+            if is_first:
+                FIRST_REQUEST_SECONDS.set(elapsed, endpoint=endpoint)
+                metrics.log_event("first_request", endpoint=endpoint, duration_ms=round(elapsed * 1000, 3))
+            metrics.log_event(
+                "request",
+                method=request.method,
+                path=request.path,
+                status=response.status_code,
+                duration_ms=round(elapsed * 1000, 3),
+            )
+        trace_id = metrics.current_trace_id()
+        if trace_id:
+            response.headers["X-Request-ID"] = trace_id
+        return response
+
     @app.route("/health", methods=["GET"])  # liveness
     def health() -> Tuple[Any, int]:
         return jsonify({"status": "ok"}), 200
 
+    @app.route("/ready", methods=["GET"])  # readiness: 200 once warm-up has succeeded
+    def ready() -> Tuple[Any, int]:
+        with warmup_lock:
+            steps = {name: dict(step) for name, step in warmup_steps.items()}
+            phases = dict(startup_phases)
+        failed = [name for name in WARMUP_REQUIRED_STEPS if steps.get(name, {}).get("status") == "error"]
+        if not warmup_done.is_set():
+            status = "warming"
+        else:
+            status = "failed" if failed else "ready"
+        body = {
+            "status": status,
+            "ready": status == "ready",
+            "failed_steps": failed,
+            "warmup": steps,
+            "startup_seconds": {"import": IMPORT_SECONDS, **phases},
+        }
+        return jsonify(body), 200 if status == "ready" else 503
+
+    @app.route("/metrics", methods=["GET"])  # Prometheus scrape endpoint
+    def metrics_endpoint():
+        response = make_response(metrics.render(), 200)
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+
+    @app.route("/backends", methods=["GET"])  # LLM backend pool health and load
+    def backends_status() -> Tuple[Any, int]:
+        return jsonify({"backends": backends.status()}), 200
+
+    @app.route("/prompts/stats", methods=["GET"])  # estimated token savings per template
+    def prompt_stats() -> Tuple[Any, int]:
+        return jsonify(templates.report()), 200
+
     @app.route("/generate", methods=["POST", "OPTIONS"])  # proxy to LM Studio generator
     def generate() -> Tuple[Any, int]:
         if request.method == "OPTIONS":
@@ -44,37 +191,64 @@ def create_main_app() -> Flask:
         csv_max_rows = int(data.get("csv_max_rows", 1000))
         rag_columns = data.get("rag_columns", "*")
         rag_max_chars = int(data.get("rag_max_chars", 4000))
+        try:
+            timeout_s = float(data.get("timeout_s", generate_deadline))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'timeout_s' must be a number."}), 400
+        if "timeout_s" in data and not timeout_s > 0:
+            return jsonify({"error": "'timeout_s' must be positive."}), 400
+        timeout_s = min(timeout_s, generate_deadline)
+        layout = data.get("prompt_layout", default_layout)
+        if layout not in prompt_layout.LAYOUTS:
+            return jsonify({"error": f"Unknown prompt_layout: {layout}"}), 400
+        # With csv_content, context_id pins the rendered table under that ID;
+        # without it, the pinned table is reused byte-for-byte.
+        context_id = data.get("context_id")
 
         csv_context = None
         try:
             if csv_content:
-                csv_context = lm_test._build_csv_context_from_text(
-                    csv_text=csv_content,
-                    delimiter=csv_delimiter,
-                    csv_max_rows=csv_max_rows,
-                    rag_columns=rag_columns,
-                    rag_max_chars=rag_max_chars,
-                )
+                with metrics.span("csv_context", source="request"):
+                    csv_context = lm_test._build_csv_context_from_text(
+                        csv_text=csv_content,
+                        delimiter=csv_delimiter,
+                        csv_max_rows=csv_max_rows,
+                        rag_columns=rag_columns,
+                        rag_max_chars=rag_max_chars,
+                        include_instructions=False,
+                    )
+                if context_id:
+                    csv_context = pinned.pin(str(context_id), csv_context)
         except Exception as exc:  # pragma: no cover
             return jsonify({"error": f"Failed to process CSV content: {exc}"}), 400
+        if not csv_content and context_id:
+            csv_context = pinned.get(str(context_id))
+            if csv_context is None:
+                return jsonify({"error": f"Unknown context_id: {context_id}"}), 400
+
+        if csv_context:
+            system_text, user_content = prompt_layout.assemble(
+                layout, lm_test.CSV_CONTEXT_INSTRUCTIONS, csv_context, prompt_text
+            )
+        else:
+            system_text, user_content = None, prompt_text
 
-        user_content = f"{csv_context}{prompt_text}" if csv_context else prompt_text
-
-        base_url = os.getenv("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
-        api_key = os.getenv("LMSTUDIO_API_KEY", "lm-studio")
         model = os.getenv("LMSTUDIO_MODEL")
         temperature = float(os.getenv("LMSTUDIO_TEMPERATURE", "0.7"))
         max_tokens = int(os.getenv("LMSTUDIO_MAX_TOKENS", "4096"))
 
         try:
-            content, model_used = lm_test._generate_completion(
+            content, model_used = _complete(
+                admission.PRIORITY_INTERACTIVE,
+                timeout_s,
                 prompt_text=user_content,
-                base_url=base_url,
-                api_key=api_key,
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
+                system_text=system_text,
             )
+        except admission.Rejected as exc:
+            return _rejected_response(exc)
         except Exception as exc:  # pragma: no cover
             return jsonify({"error": str(exc)}), 500
 
@@ -114,8 +288,7 @@ def create_main_app() -> Flask:
 
     # --- Auto-build graph.json when missing ---
     def _read_text(path: str) -> str:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+        return templates.get(path).text
 
     def _safe_json_loads(text: str):
         try:
@@ -136,37 +309,46 @@ def create_main_app() -> Flask:
                     pass
             raise
 
-    def _gen_completion(prompt_text: str) -> Tuple[str, str]:
-        base_url = os.getenv("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
-        api_key = os.getenv("LMSTUDIO_API_KEY", "lm-studio")
+    def _gen_completion(prompt_text: str, system_text: Optional[str] = None) -> Tuple[str, str]:
         model = os.getenv("LMSTUDIO_MODEL")
         temperature = float(os.getenv("LMSTUDIO_TEMPERATURE", "0.7"))
         max_tokens = int(os.getenv("LMSTUDIO_MAX_TOKENS", "4096"))
-        return lm_test._generate_completion(
+        return _complete(
+            admission.PRIORITY_BACKGROUND,
+            graph_deadline,
             prompt_text=prompt_text,
-            base_url=base_url,
-            api_key=api_key,
             model=model,
             temperature=temperature,
             max_tokens=max_tokens,
+            system_text=system_text,
         )
 
     def _csv_context(csv_path: str) -> str:
-        return lm_test._build_csv_context_from_file(
-            file_path=csv_path,
-            delimiter=",",
-            csv_max_rows=1000,
-            rag_columns="*",
-            rag_max_chars=4000,
-        )
+        """Table block only; callers add CSV_CONTEXT_INSTRUCTIONS per layout."""
+        with metrics.span("csv_context", source=os.path.basename(csv_path)):
+            return lm_test._build_csv_context_from_file(
+                file_path=csv_path,
+                delimiter=",",
+                csv_max_rows=1000,
+                rag_columns="*",
+                rag_max_chars=4000,
+                include_instructions=False,
+            )
 
     def _ensure_nodes_from_csv(csv_path: str, prompt_path: str, out_json_path: str) -> list:
         if not os.path.exists(csv_path):
             return []
         prompt_text = _read_text(prompt_path)
         context = _csv_context(csv_path)
-        content, _ = _gen_completion(f"{context}{prompt_text}")
-        data = _safe_json_loads(content)
+        if default_layout == prompt_layout.LAYOUT_PREFIX:
+            # Summary template first so every rebuild shares it as a prefix
+            content, _ = _gen_completion(
+                context, system_text=f"{prompt_text}\n\n{lm_test.CSV_CONTEXT_INSTRUCTIONS}"
+            )
+        else:
+            content, _ = _gen_completion(f"{lm_test.CSV_CONTEXT_INSTRUCTIONS}{context}{prompt_text}")
+        with metrics.span("json_parse", source=os.path.basename(csv_path)):
+            data = _safe_json_loads(content)
         if isinstance(data, dict) and "Nodes" in data:
             nodes = data.get("Nodes") or []
         else:
@@ -196,15 +378,22 @@ def create_main_app() -> Flask:
                 return []
 
     def _generate_links_from_nodes(diag_nodes: list, lab_nodes: list, med_nodes: list, linker_prompt_path: str) -> list:
-        linker_tmpl = _read_text(linker_prompt_path)
-        prompt_filled = (
-            linker_tmpl
-            .replace("<PATIENT_DIAGNOSES>", json.dumps(diag_nodes, ensure_ascii=False, indent=2))
-            .replace("<PATIENT_LABS>", json.dumps(lab_nodes, ensure_ascii=False, indent=2))
-            .replace("<PATIENT_MEDICATIONS>", json.dumps(med_nodes, ensure_ascii=False, indent=2))
-        )
-        content, _ = _gen_completion(prompt_filled)
-        data = _safe_json_loads(content)
+        values = {
+            "PATIENT_DIAGNOSES": diag_nodes,
+            "PATIENT_LABS": lab_nodes,
+            "PATIENT_MEDICATIONS": med_nodes,
+        }
+        with metrics.span("prompt_render", template="linker_prompt"):
+            if default_layout == prompt_layout.LAYOUT_PREFIX:
+                system_text, prompt_filled = templates.render_split(
+                    linker_prompt_path, values, drop_fields=prune_fields
+                )
+            else:
+                system_text = None
+                prompt_filled = templates.render(linker_prompt_path, values, drop_fields=prune_fields)
+        content, _ = _gen_completion(prompt_filled, system_text=system_text)
+        with metrics.span("json_parse", source="linker"):
+            data = _safe_json_loads(content)
         links = data.get("Links") if isinstance(data, dict) else []
         if not isinstance(links, list):
             links = []
@@ -268,26 +457,7 @@ def create_main_app() -> Flask:
 
         return graph_obj
 
-    @app.route("/graph", methods=["GET"])  # returns GraphCanvas GraphData
-    def graph() -> Tuple[Any, int]:
-        # Resolve path to project root and graph.json
-        this_dir = os.path.dirname(os.path.abspath(__file__))
-        repo_root = os.path.abspath(os.path.join(this_dir, os.pardir, os.pardir))
-        graph_path = os.path.join(repo_root, "graph.json")
-
-        # If graph.json is missing, auto-build it using prompts + CSVs
-        data = None
-        if not os.path.exists(graph_path):
-            try:
-                data = _autobuild_graph(repo_root)
-            except Exception as exc:
-                # Fall back to empty graph if generation fails
-                return jsonify({"nodes": [], "edges": [], "error": f"graph build failed: {exc}"}), 200
-
-        if data is None:
-            with open(graph_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
+    def _graph_payload_from(data: Dict[str, Any]) -> Dict[str, Any]:
         links = data.get("Links", []) or []
 
         nodes_map: Dict[str, Dict[str, Any]] = {}
@@ -324,16 +494,129 @@ def create_main_app() -> Flask:
                 }
             )
 
-        graph_payload = {"nodes": list(nodes_map.values()), "edges": edges_list}
-        return jsonify(graph_payload), 200
+        return {"nodes": list(nodes_map.values()), "edges": edges_list}
+
+    def _cached_graph_payload(graph_path: str) -> Dict[str, Any]:
+        st = os.stat(graph_path)
+        stamp = (graph_path, st.st_mtime_ns, st.st_size)
+        entry = graph_cache.get("entry")
+        if entry is not None and entry[0] == stamp:
+            metrics.CACHE_EVENTS.inc(cache="graph_payload", result="hit")
+            return entry[1]
+        metrics.CACHE_EVENTS.inc(cache="graph_payload", result="miss")
+        with metrics.span("graph_load"):
+            with open(graph_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        with metrics.span("graph_transform"):
+            payload = _graph_payload_from(data)
+        graph_cache["entry"] = (stamp, payload)
+        return payload
+
+    @app.route("/graph", methods=["GET"])  # returns GraphCanvas GraphData
+    def graph() -> Tuple[Any, int]:
+        # Resolve path to project root and graph.json
+        repo_root = _default_graph_root()
+        graph_path = os.path.join(repo_root, "graph.json")
+
+        # If graph.json is missing, auto-build it using prompts + CSVs
+        if not os.path.exists(graph_path):
+            metrics.CACHE_EVENTS.inc(cache="graph", result="miss")
+            try:
+                with metrics.span("autobuild"):
+                    data = _autobuild_graph(repo_root)
+            except Exception as exc:
+                # Fall back to empty graph if generation fails
+                return jsonify({"nodes": [], "edges": [], "error": f"graph build failed: {exc}"}), 200
+            with metrics.span("graph_transform"):
+                return jsonify(_graph_payload_from(data)), 200
+
+        metrics.CACHE_EVENTS.inc(cache="graph", result="hit")
+        return jsonify(_cached_graph_payload(graph_path)), 200
+
+    # --- Optional warm-up (WARMUP=1) ---
+    warmup_done = threading.Event()
+    # Written by the warm-up thread, read by /ready; guarded by warmup_lock
+    warmup_lock = threading.Lock()
+    warmup_steps: Dict[str, Dict[str, Any]] = {}
+    startup_phases: Dict[str, float] = {}
+
+    def _warmup_step(name: str, fn) -> None:
+        start = time.perf_counter()
+        try:
+            fn()
+            result: Dict[str, Any] = {"status": "ok"}
+        except Exception as exc:
+            result = {"status": "error", "error": str(exc)}
+        result["seconds"] = round(time.perf_counter() - start, 4)
+        with warmup_lock:
+            warmup_steps[name] = result
+
+    def _warm_models() -> None:
+        healthy = [backends.probe(b) for b in backends.backends]
+        if not any(healthy):
+            raise RuntimeError("No LLM backend answered the health probe")
+
+    def _warm_csv_tables() -> None:
+        if not csv_cache.cache_enabled():
+            return
+        root = _default_graph_root()
+        for name in ("diagnoses.csv", "labs.csv", "medications.csv"):
+            path = os.path.join(root, name)
+            if os.path.exists(path):
+                csv_cache.open_table(path, ",")
+
+    def _warm_graph() -> None:
+        graph_path = os.path.join(_default_graph_root(), "graph.json")
+        if os.path.exists(graph_path):
+            _cached_graph_payload(graph_path)
+
+    def _warm_completion() -> None:
+        backends.complete(
+            prompt_text="ping",
+            model=os.getenv("LMSTUDIO_MODEL"),
+            temperature=0.0,
+            max_tokens=1,
+            timeout=float(os.getenv("WARMUP_TIMEOUT_S", "60")),
+        )
+
+    def _warmup() -> None:
+        start = time.perf_counter()
+        steps: List[Tuple[str, Any]] = [
+            # Import openai and open one pooled client per backend
+            ("clients", lambda: [lm_test.get_client(b.base_url, backends.api_key) for b in backends.backends]),
+            # Health-check backends and record the model each one serves
+            ("models", _warm_models),
+            ("csv_tables", _warm_csv_tables),
+            ("graph", _warm_graph),
+        ]
+        if os.getenv("WARMUP_COMPLETION", "1") != "0":
+            steps.append(("completion", _warm_completion))
+        for name, fn in steps:
+            _warmup_step(name, fn)
+        elapsed = time.perf_counter() - start
+        with warmup_lock:
+            startup_phases["warmup"] = round(elapsed, 4)
+            steps_done = dict(warmup_steps)
+        STARTUP_SECONDS.set(elapsed, phase="warmup")
+        metrics.log_event("warmup", duration_ms=round(elapsed * 1000, 3), steps=steps_done)
+        warmup_done.set()
+
+    startup_phases["create_app"] = round(time.perf_counter() - create_start, 4)
+    STARTUP_SECONDS.set(startup_phases["create_app"], phase="create_app")
+    if os.getenv("WARMUP", "0") == "1":
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    else:
+        warmup_done.set()
 
     return app
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "5001"))
     app = create_main_app()
+    metrics.log_event("startup", import_s=round(IMPORT_SECONDS, 4))
     app.run(host=host, port=port)
 
 
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+
+
+def _start_waiter(controller, priority, results, deadline=float("inf")):
+    """Call acquire() on a thread; appends (priority, outcome) when it returns."""
+
+    def run():
+        try:
+            controller.acquire(priority, deadline)
+            results.append((priority, "granted"))
+        except admission.Rejected as exc:
+            results.append((priority, type(exc).__name__))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for_queue(controller, depth, timeout=2.0):
+    end = time.monotonic() + timeout
+    while controller.queued < depth:
+        assert time.monotonic() < end, "waiters never queued"
+        time.sleep(0.005)
+
+
+def test_queue_full_rejects_same_priority():
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1, max_queue=1)
+    controller.acquire()
+    results = []
+    waiter = _start_waiter(controller, admission.PRIORITY_INTERACTIVE, results)
+    _wait_for_queue(controller, 1)
+
+    with pytest.raises(admission.QueueFull) as excinfo:
+        controller.acquire(admission.PRIORITY_INTERACTIVE)
+    assert excinfo.value.status == 429
+
+    controller.release()
+    waiter.join(1)
+    assert results == [(admission.PRIORITY_INTERACTIVE, "granted")]
+
+
+def test_queue_full_sheds_lower_priority_waiter():
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1, max_queue=1)
+    controller.acquire()
+    results = []
+    background = _start_waiter(controller, admission.PRIORITY_BACKGROUND, results)
+    _wait_for_queue(controller, 1)
+    interactive = _start_waiter(controller, admission.PRIORITY_INTERACTIVE, results)
+    background.join(1)
+    assert results == [(admission.PRIORITY_BACKGROUND, "QueueFull")]
+
+    controller.release()
+    interactive.join(1)
+    assert results[-1] == (admission.PRIORITY_INTERACTIVE, "granted")
+
+
+def test_interactive_is_served_before_background():
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1, max_queue=4)
+    controller.acquire()
+    results = []
+    threads = [_start_waiter(controller, admission.PRIORITY_BACKGROUND, results)]
+    _wait_for_queue(controller, 1)
+    threads.append(_start_waiter(controller, admission.PRIORITY_INTERACTIVE, results))
+    _wait_for_queue(controller, 2)
+
+    controller.release()
+    threads[1].join(1)
+    controller.release()
+    threads[0].join(1)
+    assert results == [
+        (admission.PRIORITY_INTERACTIVE, "granted"),
+        (admission.PRIORITY_BACKGROUND, "granted"),
+    ]
+
+
+def test_waiter_deadline_expires():
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1, max_queue=4)
+    controller.acquire()
+    results = []
+    waiter = _start_waiter(
+        controller, admission.PRIORITY_INTERACTIVE, results, deadline=time.monotonic() + 0.05
+    )
+    waiter.join(1)
+    assert results == [(admission.PRIORITY_INTERACTIVE, "DeadlineExceeded")]
+    assert controller.queued == 0
+
+
+@pytest.mark.parametrize("timeout", [0, -1])
+def test_non_positive_timeout_is_already_expired(timeout):
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1)
+    controller.acquire()
+    start = time.monotonic()
+    with pytest.raises(admission.DeadlineExceeded):
+        with controller.slot(timeout=timeout):
+            pass
+    assert time.monotonic() - start < 0.1
+
+
+def test_slow_background_calls_do_not_cut_the_limit():
+    controller = admission.AdmissionController(initial_limit=2, max_limit=8)
+    for i in range(200):
+        controller.acquire()
+        if i % 3 == 0:
+            controller.release(5.0, True, admission.PRIORITY_BACKGROUND)
+        else:
+            controller.release(0.5, True, admission.PRIORITY_INTERACTIVE)
+    assert controller.limit == 8
+
+
+def test_errors_cut_the_limit():
+    controller = admission.AdmissionController(initial_limit=8, max_limit=8)
+    controller.acquire()
+    controller.release(0.5, ok=False)
+    assert controller.limit < 8
+
+
+def test_request_errors_do_not_cut_the_limit():
+    controller = admission.AdmissionController(initial_limit=8, max_limit=8)
+    for _ in range(4):
+        with pytest.raises(ValueError):
+            with controller.slot(is_congestion=lambda exc: isinstance(exc, ConnectionError)):
+                raise ValueError("bad request")
+    assert controller.limit == 8
+    assert controller.inflight == 0
+
+    with pytest.raises(ConnectionError):
+        with controller.slot(is_congestion=lambda exc: isinstance(exc, ConnectionError)):
+            raise ConnectionError("backend down")
+    assert controller.limit < 8
+
+
+def test_wait_estimate_uses_latency_of_waiters_ahead():
+    controller = admission.AdmissionController(initial_limit=1, max_limit=1, max_queue=4)
+    for _ in range(5):
+        controller.acquire(admission.PRIORITY_BACKGROUND)
+        controller.release(5.0, True, admission.PRIORITY_BACKGROUND)
+        controller.acquire(admission.PRIORITY_INTERACTIVE)
+        controller.release(0.1, True, admission.PRIORITY_INTERACTIVE)
+
+    controller.acquire(admission.PRIORITY_BACKGROUND)
+    results = []
+    background = _start_waiter(controller, admission.PRIORITY_BACKGROUND, results)
+    _wait_for_queue(controller, 1)
+    # Only interactive work is ahead of an interactive request, so a 1s
+    # deadline is enough even though background calls take 5s.
+    interactive = _start_waiter(
+        controller, admission.PRIORITY_INTERACTIVE, results, deadline=time.monotonic() + 1.0
+    )
+    _wait_for_queue(controller, 2)
+    controller.release(count=False)
+    interactive.join(1)
+    assert results == [(admission.PRIORITY_INTERACTIVE, "granted")]
+
+    # A background request behind another 5s background call cannot make it.
+    with pytest.raises(admission.Rejected):
+        controller.acquire(admission.PRIORITY_BACKGROUND, time.monotonic() + 1.0)
+    controller.release(count=False)
+    background.join(1)
@@ -0,0 +1,158 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_cache
+import lm_test
+
+# Ragged rows, values beyond int64, ints that do not round-trip ("007",
+# "-0"), a quoted newline, and more cells than header columns.
+MESSY_CSV = (
+    "id,name,value\n"
+    "1,Sodium,135,extra\n"
+    "2,Potassium\n"
+    '3,"Note with\nnewline",4.5\n'
+    "99999999999999999999,Big,007\n"
+    "-5,Neg,-0\n"
+    ",,\n"
+)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("CSV_CACHE_DIR", str(directory))
+    monkeypatch.setenv("CSV_CACHE", "1")
+    csv_cache.clear_tables()
+    yield directory
+    csv_cache.clear_tables()
+
+
+@pytest.fixture
+def ingests(monkeypatch):
+    calls = []
+    real = csv_cache.ingest
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(csv_cache, "ingest", counting)
+    return calls
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    return str(path)
+
+
+def _parsed(path, max_rows, monkeypatch):
+    monkeypatch.setenv("CSV_CACHE", "0")
+    try:
+        return lm_test._load_csv_head_rows(path, ",", max_rows)
+    finally:
+        monkeypatch.setenv("CSV_CACHE", "1")
+
+
+@pytest.mark.parametrize("max_rows", [1, 3, 1000])
+def test_round_trip_matches_csv_loader(tmp_path, cache_dir, monkeypatch, max_rows):
+    path = _write(tmp_path / "messy.csv", MESSY_CSV)
+    assert csv_cache.load_head_rows(path, ",", max_rows) == _parsed(path, max_rows, monkeypatch)
+    # Again from the on-disk cache, not the in-memory table.
+    csv_cache.clear_tables()
+    assert csv_cache.load_head_rows(path, ",", max_rows) == _parsed(path, max_rows, monkeypatch)
+
+
+def test_column_kinds(tmp_path, cache_dir):
+    path = _write(tmp_path / "messy.csv", MESSY_CSV)
+    kinds = [c["kind"] for c in csv_cache.open_table(path).meta["columns"]]
+    # id holds a >int64 value and an empty cell; value holds "007" and "-0".
+    assert kinds == ["dict", "dict", "dict", "dict"]
+
+    ints = _write(tmp_path / "ints.csv", "a,b\n1,-2\n30,4\n")
+    assert [c["kind"] for c in csv_cache.open_table(ints).meta["columns"]] == ["int", "int"]
+    assert csv_cache.load_head_rows(ints, ",", 10) == (["a", "b"], [["1", "-2"], ["30", "4"]])
+
+
+def test_projection_and_where(tmp_path, cache_dir):
+    path = _write(
+        tmp_path / "labs.csv",
+        "id,kind,name\n1,lab,Sodium\n2,med,Aspirin\n3,lab,Potassium\n4,lab,Chloride\n",
+    )
+    table = csv_cache.open_table(path)
+    assert table.select(columns=["name", 0], limit=2) == (["name", "id"], [["Sodium", "1"], ["Aspirin", "2"]])
+    assert table.select(columns=["name"], where={"kind": "lab"}) == (
+        ["name"],
+        [["Sodium"], ["Potassium"], ["Chloride"]],
+    )
+    assert table.select(columns=["name"], where={"kind": "lab", "id": ["3", "4"]}, limit=1) == (
+        ["name"],
+        [["Potassium"]],
+    )
+    assert table.select(columns=["id"], where={"name": lambda v: v.startswith("C")}) == (["id"], [["4"]])
+
+
+def test_invalidated_by_size_and_mtime(tmp_path, cache_dir, ingests):
+    path = _write(tmp_path / "labs.csv", "a,b\n1,2\n")
+    csv_cache.open_table(path)
+    csv_cache.open_table(path)
+    assert len(ingests) == 1
+
+    _write(path, "a,b\n1,2\n3,4\n")
+    assert csv_cache.load_head_rows(path, ",", 10) == (["a", "b"], [["1", "2"], ["3", "4"]])
+    assert len(ingests) == 2
+
+
+def test_invalidated_by_sha256_when_size_matches(tmp_path, cache_dir, ingests):
+    path = _write(tmp_path / "labs.csv", "a,b\n1,2\n")
+    csv_cache.open_table(path)
+    csv_cache.clear_tables()
+
+    # Same size, new content, restored mtime: only the hash can tell.
+    stat = os.stat(path)
+    _write(path, "a,b\n7,8\n")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert csv_cache.load_head_rows(path, ",", 10) == (["a", "b"], [["7", "8"]])
+    assert len(ingests) == 2
+
+    # Touched but unchanged: the hash matches, so the cache is reused.
+    csv_cache.clear_tables()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2))
+    csv_cache.open_table(path)
+    assert len(ingests) == 2
+
+
+def test_same_basename_in_different_dirs(tmp_path, cache_dir, ingests):
+    os.makedirs(tmp_path / "a")
+    os.makedirs(tmp_path / "b")
+    first = _write(tmp_path / "a" / "labs.csv", "x\n1\n")
+    second = _write(tmp_path / "b" / "labs.csv", "x\n2\n")
+    assert csv_cache.cache_path_for(first, ",") != csv_cache.cache_path_for(second, ",")
+    csv_cache.open_table(first)
+    csv_cache.open_table(second)
+    csv_cache.clear_tables()
+    assert csv_cache.load_head_rows(first, ",", 10) == (["x"], [["1"]])
+    assert csv_cache.load_head_rows(second, ",", 10) == (["x"], [["2"]])
+    assert len(ingests) == 2
+
+
+def test_cache_from_another_source_path_is_rejected(tmp_path, cache_dir):
+    source = _write(tmp_path / "labs.csv", "x\n1\n")
+    copy = _write(tmp_path / "copy.csv", "x\n1\n")
+    os.makedirs(cache_dir, exist_ok=True)
+    os.replace(csv_cache.ingest(source), csv_cache.cache_path_for(copy, ","))
+    stat = {"mtime_ns": os.stat(copy).st_mtime_ns, "size": os.stat(copy).st_size}
+    assert not csv_cache._is_fresh(csv_cache.cache_path_for(copy, ","), copy, stat)
+
+
+def test_replaced_table_is_closed(tmp_path, cache_dir):
+    path = _write(tmp_path / "labs.csv", "a\n1\n")
+    old = csv_cache.open_table(path)
+    _write(path, "a\n1\n2\n")
+    new = csv_cache.open_table(path)
+    assert new is not old
+    assert old._fh.closed and not new._fh.closed
@@ -0,0 +1,130 @@
+import os
+import sys
+import types
+
+import openai
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_router
+import lm_test
+
+
+def _status_error(cls, status):
+    response = types.SimpleNamespace(status_code=status, request=None, headers={})
+    return cls(f"HTTP {status}", response=response, body=None)
+
+
+def _chained(cause):
+    try:
+        try:
+            raise cause
+        except Exception as exc:
+            raise RuntimeError("No model specified and unable to auto-detect.") from exc
+    except RuntimeError as exc:
+        return exc
+
+
+@pytest.mark.parametrize(
+    "exc, fault",
+    [
+        (openai.APIConnectionError(request=None), True),
+        (openai.APITimeoutError(request=None), True),
+        (ConnectionRefusedError(), True),
+        (_status_error(openai.InternalServerError, 503), True),
+        (_status_error(openai.BadRequestError, 400), False),
+        (_status_error(openai.RateLimitError, 429), False),
+        (RuntimeError("No content returned."), False),
+        (_chained(openai.APIConnectionError(request=None)), True),
+    ],
+)
+def test_is_backend_fault(exc, fault):
+    assert llm_router.is_backend_fault(exc) is fault
+
+
+def test_is_timeout():
+    assert llm_router.is_timeout(openai.APITimeoutError(request=None))
+    assert llm_router.is_timeout(TimeoutError())
+    assert not llm_router.is_timeout(openai.APIConnectionError(request=None))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record which backend each completion went to; outcomes come from `script`."""
+    log = []
+    script = {}
+
+    def fake_completion(**kwargs):
+        log.append(kwargs["base_url"])
+        outcome = script.get(kwargs["base_url"], ("ok",))
+        if outcome[0] == "raise":
+            raise outcome[1]
+        return "content", "model"
+
+    monkeypatch.setattr(lm_test, "_generate_completion", fake_completion)
+    return log, script
+
+
+def _pool():
+    return llm_router.BackendPool(["http://a/v1", "http://b/v1", "http://c/v1"])
+
+
+def test_prefers_least_loaded_healthy_backend(calls):
+    log, _ = calls
+    pool = _pool()
+    a, b, c = pool.backends
+    a.ewma_latency, b.ewma_latency, c.ewma_latency = 1.0, 0.4, 0.2
+    c.healthy = False
+    b.inflight = 2
+    # Scores: b = 3 * 0.4 is busier than a = 1 * 1.0; unhealthy c goes last.
+    assert [x.base_url for x in pool._ranked()] == ["http://a/v1", "http://b/v1", "http://c/v1"]
+    pool.complete("p", None, 0.0, 1)
+    assert log == ["http://a/v1"]
+
+
+def test_fails_over_on_backend_fault(calls):
+    log, script = calls
+    pool = _pool()
+    script["http://a/v1"] = ("raise", _status_error(openai.InternalServerError, 500))
+    script["http://b/v1"] = ("raise", openai.APIConnectionError(request=None))
+    assert pool.complete("p", None, 0.0, 1) == ("content", "model")
+    assert log == ["http://a/v1", "http://b/v1", "http://c/v1"]
+    status = {s["base_url"]: s for s in pool.status()}
+    assert status["http://a/v1"]["consecutive_failures"] == 1
+    assert status["http://c/v1"]["consecutive_failures"] == 0
+
+
+@pytest.mark.parametrize(
+    "exc", [_status_error(openai.BadRequestError, 400), RuntimeError("No content returned.")]
+)
+def test_request_errors_are_not_retried_or_counted(calls, exc):
+    log, script = calls
+    pool = _pool()
+    for backend in pool.backends:
+        script[backend.base_url] = ("raise", exc)
+    for _ in range(3):
+        with pytest.raises(type(exc)):
+            pool.complete("p", None, 0.0, 1)
+    assert len(log) == 3
+    assert all(s["healthy"] and s["consecutive_failures"] == 0 for s in pool.status())
+
+
+def test_deadline_timeout_is_not_counted(calls):
+    log, script = calls
+    pool = _pool()
+    for backend in pool.backends:
+        script[backend.base_url] = ("raise", openai.APITimeoutError(request=None))
+    for _ in range(3):
+        with pytest.raises(openai.APITimeoutError):
+            pool.complete("p", None, 0.0, 1, timeout=0.05)
+    assert len(log) == 3
+    assert all(s["healthy"] and s["consecutive_failures"] == 0 for s in pool.status())
+
+
+def test_timeout_without_deadline_fails_over(calls):
+    log, script = calls
+    pool = _pool()
+    script["http://a/v1"] = ("raise", openai.APITimeoutError(request=None))
+    pool.complete("p", None, 0.0, 1)
+    assert log == ["http://a/v1", "http://b/v1"]